@@ -1,10 +1,15 @@
-import datetime, logging, os, random, redis, json
+import time
+START_TIME = time.perf_counter()
+import asyncio, datetime, logging, os, random, redis, json
 from enum import Enum
-from handlers.ChessHandler import ChessHandler
-from handlers.OthelloHandler import OthelloHandler
 from utils.utils import INTRO_TEXT, ADMIN, ANNOUNCE_TEXT
-import utils.setup as setup
+from utils.executor import JobExecutor
+from utils.prefetch import PuzzleBuffer
+from utils.media_registry import MediaRegistry
+from utils.startup import StartupTimer, LazyResource
 from urllib.parse import urlparse
+# Handlers, setup and their heavy dependencies (pandas, numpy, PIL, cairosvg) are imported
+# in the background once the webhook is up, see load_chess_handler and load_othello_handler
 
 
 TOKEN = str(os.environ['TOKEN']) # Set environment variable via Heroku
@@ -12,6 +17,24 @@ SECRET = str(os.environ['SECRET']) # Set environment variable via Heroku
 APPNAME = str(os.environ['APPNAME']) # Set environment var via Heroku
 PORT = int(os.environ.get('PORT', '8443'))
 REDIS_URL = os.environ.get('REDISCLOUD_URL')
+ENGINE_POOL_SIZE = int(os.environ.get('ENGINE_POOL_SIZE', '0')) or None # Defaults to host cores
+ENGINE_HASH = int(os.environ.get('ENGINE_HASH', '64'))
+ENGINE_THREADS = int(os.environ.get('ENGINE_THREADS', '1'))
+BOARD_RENDERER = os.environ.get('BOARD_RENDERER', 'svg') # "svg" or "sprite"
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', '0')) or None # Defaults to host cores
+JOB_TIMEOUT = float(os.environ.get('JOB_TIMEOUT', '120')) # Seconds before a puzzle/game job is abandoned
+PREFETCH_SIZE = int(os.environ.get('PREFETCH_SIZE', '5')) # Ready puzzles kept per game
+PREFETCH_LOW_WATER = int(os.environ.get('PREFETCH_LOW_WATER', '2'))
+MEDIA_REGISTRY_SIZE = int(os.environ.get('MEDIA_REGISTRY_SIZE', '20000')) # Telegram file_ids remembered
+PUZZLE_BUDGET_MS = int(os.environ.get('PUZZLE_BUDGET_MS', '0')) # Engine time per puzzle, 0 for fixed depth
+VOTE_BUDGET_MS = int(os.environ.get('VOTE_BUDGET_MS', '0')) # Engine time per set of vote choices, 0 for fixed depth
+CPU_BUDGET_MS = int(os.environ.get('CPU_BUDGET_MS', '0')) # Engine time per CPU reply, 0 for fixed depth
+OTHELLO_BUDGET_MS = int(os.environ.get('OTHELLO_BUDGET_MS', '0')) # Othello search time per vote or CPU move, 0 for full depth
+# Processes each Othello search spreads its root moves over, on top of WORKER_PROCESSES.
+# Capped so that WORKER_PROCESSES searches at once use at most the host cores.
+OTHELLO_SEARCH_WORKERS = int(os.environ.get('OTHELLO_SEARCH_WORKERS', '1'))
+BROADCAST = os.environ.get('BROADCAST', '0') == '1' # Share one scheduled puzzle between chats with the same slot
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', '20')) # Chats sent to at the same time
 
 # from utils.config import TOKEN, REDIS_URL
 
@@ -54,27 +77,146 @@ def remove_queued(job_queue, job_name):
         job.schedule_removal()
 
 
+def broadcast_name(task, time_str, options):
+    """
+    Name of the shared job sending a puzzle to every chat scheduled for the same slot.
+    """
+    return f"broadcast_{task.value}_{time_str}_{json.dumps(options, sort_keys=True) if options else ''}"
+
+
+def schedule_broadcast(job_queue, chat_id, handler, task, time, time_str, options=None):
+    """
+    Subscribes a chat to the shared puzzle job of its slot, creating the job if needed.
+    """
+    name = broadcast_name(task, time_str, options)
+    jobs = job_queue.get_jobs_by_name(name)
+    if jobs:
+        jobs[0].data["chat_ids"].add(chat_id)
+        return jobs[0]
+    data = {"handler":handler, "task":task, "options":options, "chat_ids":{chat_id}}
+    return job_queue.run_daily(broadcast_puzzle, time=time, data=data, name=name)
+
+
+def broadcast_jobs(job_queue, chat_id):
+    """
+    Shared puzzle jobs the chat is subscribed to.
+    """
+    return [job for job in job_queue.jobs() if job.name and job.name.startswith("broadcast_")
+            and chat_id in job.data["chat_ids"]]
+
+
+def parse_puzzle_options(args):
+    """
+    Parses optional chess puzzle arguments, e.g. ["1800", "mates"].
+
+        Returns:
+            options (dict): rating and/or theme given, None if an argument is not recognized.
+    """
+    from utils.puzzle_store import find_theme
+    options = {}
+    for arg in args:
+        if arg.isdigit():
+            options["rating"] = int(arg)
+        elif find_theme(arg):
+            options["theme"] = find_theme(arg)
+        else:
+            return None
+    return options
+
+
 # --------------------------- Logic Functions --------------------------- #
 
 
-async def send_puzzle(context: CallbackContext) -> None:
+async def get_puzzle(data):
     """
-    Sends a puzzle poll to the chat.
+    Returns a puzzle for the job data, from the prefetch buffer when possible.
+    None if no puzzle matches the requested theme.
     """
-    chat_id = context.job.chat_id
-    data = context.job.data
-    handler = data["handler"]
-    board_img, choices, solution_ind, prompt, explanation, solution_video = handler.generate_puzzle()
-    await context.bot.send_animation(animation=solution_video, chat_id=chat_id, 
-                                 has_spoiler=True, disable_notification=True)
-    await context.bot.send_photo(photo=board_img,chat_id=chat_id)
-    await context.bot.send_poll(
+    options = data.get("options")
+    # Prefetched puzzles are random, so puzzles for a given rating/theme are generated on the spot
+    if options:
+        return await data["handler"].generate_puzzle_async(**options)
+    return await puzzle_buffer.get(data["task"])
+
+
+async def deliver_puzzle(bot, chat_id, puzzle) -> None:
+    """
+    Sends the solution, board and quiz poll of a puzzle to the chat.
+    """
+    board_img, choices, solution_ind, prompt, explanation, solution_video = puzzle
+    await media_registry.send(bot.send_animation, "animation", solution_video, chat_id=chat_id,
+                              has_spoiler=True, disable_notification=True)
+    await media_registry.send(bot.send_photo, "photo", board_img, chat_id=chat_id)
+    await bot.send_poll(
         question = prompt, options = choices, correct_option_id=solution_ind,
         type=Poll.QUIZ, allows_multiple_answers = False, explanation=explanation,
         chat_id=chat_id, is_anonymous = True, disable_notification=True
     )
 
-    
+
+async def send_puzzle(context: CallbackContext) -> None:
+    """
+    Sends a puzzle poll to the chat.
+    """
+    chat_id = context.job.chat_id
+    try:
+        puzzle = await get_puzzle(context.job.data)
+    except asyncio.TimeoutError:
+        logging.warning(f"Puzzle generation for {chat_id} timed out.")
+        await context.bot.send_message(chat_id=chat_id, text="Puzzle generation timed out, please try again!")
+        return
+    if puzzle is None:
+        await context.bot.send_message(chat_id=chat_id, text="No puzzles found for that theme!")
+        return
+    await deliver_puzzle(context.bot, chat_id, puzzle)
+
+
+async def broadcast_puzzle(context: CallbackContext) -> None:
+    """
+    Sends one puzzle to every chat subscribed to a shared schedule slot.
+    Chats that opted out of shared puzzles get a puzzle of their own.
+    """
+    data = context.job.data
+    task = data["task"]
+    unshared = set(context.bot_data.get("unshared_chats", []))
+    chat_ids = list(data["chat_ids"])
+    shared_ids = [chat_id for chat_id in chat_ids if chat_id not in unshared]
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def deliver(chat_id, puzzle):
+        async with semaphore:
+            try:
+                await deliver_puzzle(context.bot, chat_id, puzzle)
+            except Exception:
+                logging.exception(f"Failed to send {task.value} to {chat_id}.")
+
+    async def deliver_own(chat_id):
+        try:
+            puzzle = await get_puzzle(data)
+        except Exception:
+            logging.exception(f"Puzzle generation for {chat_id} failed.")
+            return
+        if puzzle is None:
+            logging.warning(f"No {task.value} matches {data.get('options')} for {chat_id}.")
+            return
+        await deliver(chat_id, puzzle)
+
+    own = asyncio.gather(*[deliver_own(chat_id) for chat_id in chat_ids if chat_id in unshared])
+    if shared_ids:
+        try:
+            puzzle = await get_puzzle(data)
+        except Exception:
+            logging.exception(f"Shared {task.value} generation failed.")
+        else:
+            if puzzle is None:
+                logging.warning(f"No {task.value} matches {data.get('options')}.")
+            else:
+                # The first send uploads the media, the others reuse its file_ids
+                await deliver(shared_ids[0], puzzle)
+                await asyncio.gather(*[deliver(chat_id, puzzle) for chat_id in shared_ids[1:]])
+    await own
+
+
 
 
 async def send_votegame(context: CallbackContext) -> None:
@@ -88,29 +230,34 @@ async def send_votegame(context: CallbackContext) -> None:
         vc_data = {}
     chat_data = vc_data.get(str(chat_id))
 
-    # Case: Game has not been initialized
-    if not chat_data:
-        board_img, choices, solution_ind, prompt, board_state = handler.new_votechess()
+    try:
+        # Case: Game has not been initialized
+        if not chat_data:
+            board_img, choices, solution_ind, prompt, board_state = await handler.new_votechess_async()
 
-    # Case: Game has been initialized
-    else:
-        board_state = chat_data.get("board")
-        # Get the most voted move
-        moves = chat_data.get("player_moves")
-        choices = []
-        for player_choice in moves.values():
-            choices.extend(player_choice)
-
-        # Case: Nobody voted -> generate poll from the same position
-        if len(choices) == 0:
-            board_img, choices, solution_ind, prompt, board_state = handler.generate_votechess(board_state, None)
-        # Case: Top move exists
+        # Case: Game has been initialized
         else:
-            top_choice = max(set(choices), key = choices.count) # If tie, selects first index
-            top_move = chat_data.get("move_choices")[top_choice]
-            board_img, choices, solution_ind, prompt, board_state = handler.generate_votechess(board_state, top_move)
+            board_state = chat_data.get("board")
+            # Get the most voted move
+            moves = chat_data.get("player_moves")
+            choices = []
+            for player_choice in moves.values():
+                choices.extend(player_choice)
+
+            # Case: Nobody voted -> generate poll from the same position
+            if len(choices) == 0:
+                board_img, choices, solution_ind, prompt, board_state = await handler.generate_votechess_async(board_state, None)
+            # Case: Top move exists
+            else:
+                top_choice = max(set(choices), key = choices.count) # If tie, selects first index
+                top_move = chat_data.get("move_choices")[top_choice]
+                board_img, choices, solution_ind, prompt, board_state = await handler.generate_votechess_async(board_state, top_move)
+    except asyncio.TimeoutError:
+        logging.warning(f"{task.value} move for {chat_id} timed out.")
+        await context.bot.send_message(chat_id=chat_id, text="The engine took too long, please try again!")
+        return
 
-    message = await context.bot.send_photo(photo=board_img,chat_id=chat_id)
+    message = await media_registry.send(context.bot.send_photo, "photo", board_img, chat_id=chat_id)
     cleaned_choices = [choice.replace("#", "+") for choice in choices]
     # Case: Game has not ended
     if solution_ind >= 0:
@@ -155,7 +302,12 @@ async def start(update: Update, context: CallbackContext) -> None:
 async def command_chess_puzzle(update: Update, context: CallbackContext) -> None:
     chat_id = update.effective_chat.id
     handler = chess_handler
-    data = {"handler":handler, "task":Task.CHESS_PUZZLE}
+    options = parse_puzzle_options(context.args)
+    if options is None:
+        reply = "Unrecognized arguments! Please follow the syntax: /chess <rating> <theme>"
+        await context.bot.send_message(chat_id=chat_id, text=reply)
+        return
+    data = {"handler":handler, "task":Task.CHESS_PUZZLE, "options":options}
     context.job_queue.run_once(send_puzzle, 0, chat_id=chat_id, data=data)
 
 
@@ -198,7 +350,7 @@ async def command_chess_vote(update: Update, context: CallbackContext) -> None:
 async def command_set_schedule(update: Update, context: CallbackContext) -> None:
     chat_id = update.effective_chat.id
     schedules = context.bot_data.get("schedules")
-    handler, time_str, reply = None, None, ""
+    handler, time_str, options, reply = None, None, None, ""
 
     # Parse user arguments
     if len(context.args) >= 2:
@@ -223,13 +375,19 @@ async def command_set_schedule(update: Update, context: CallbackContext) -> None
         if context.args[1].isdigit() and len(context.args[1]) == 4:
             time_str = context.args[1]
 
+        # Puzzle rating and theme (chess only)
+        if len(context.args) > 2:
+            options = parse_puzzle_options(context.args[2:]) if game == "chess" else None
+            if options is None:
+                handler = None
+
     # Check if user arguments are valid
     if not handler or not time_str:
-        reply = "Unrecognized arguments! Please follow the syntax: /schedule_puzzle <game> <time>"
+        reply = "Unrecognized arguments! Please follow the syntax: /schedule_puzzle <game> <time> <rating> <theme>"
         await context.bot.send_message(chat_id=chat_id, text=reply)
         return
     schedule = (chat_id, task.value, time_str)
-    if schedule in schedules:
+    if any(tuple(sched[:3]) == schedule for sched in schedules):
         reply = f"Invalid time - another instance of {task.value} is already running at {time_str}H"
         await context.bot.send_message(chat_id=chat_id, text=reply)
         return
@@ -239,13 +397,16 @@ async def command_set_schedule(update: Update, context: CallbackContext) -> None
     minute = min(int(time_str[2:]),59)
     time = datetime.time(hour=hour, minute=minute, second=random.randint(0,15))
     job_name = task.value + str(chat_id)
-    data = {"handler":handler, "task":task,}
-    job = context.job_queue.run_daily(send_game, time=time, data=data,
-                                        chat_id=chat_id, name=job_name,)
+    data = {"handler":handler, "task":task, "options":options}
+    if BROADCAST and send_game is send_puzzle:
+        job = schedule_broadcast(context.job_queue, chat_id, handler, task, time, time_str, options)
+    else:
+        job = context.job_queue.run_daily(send_game, time=time, data=data,
+                                            chat_id=chat_id, name=job_name,)
     
     if job:
         reply = f"Scheduling {task.value} at {time_str}H (SGT) everyday."
-        schedules.append(schedule)
+        schedules.append(schedule + (options,) if options else schedule)
     else:
         reply = "Scheduling failed, please try again!"
     
@@ -266,6 +427,11 @@ async def command_get_schedule(update: Update, context: CallbackContext) -> None
             sgt_time = job.next_t + datetime.timedelta(hours=8)
             sgt_time = sgt_time.strftime("%d/%m/%y %H%MH")
             reply_list.append(f"{name} - {sgt_time}")
+    for job in broadcast_jobs(context.job_queue, chat_id):
+        name = job.data["task"].value.replace("_", "")
+        sgt_time = job.next_t + datetime.timedelta(hours=8)
+        sgt_time = sgt_time.strftime("%d/%m/%y %H%MH")
+        reply_list.append(f"{name} - {sgt_time}")
 
     if len(reply_list) == 0:
         reply = "There are no scheduled tasks."
@@ -282,6 +448,10 @@ async def command_clear_schedule(update: Update, context: CallbackContext) -> No
     job_names = [task.value+str(chat_id) for task in Task]
     for job_name in job_names:
         remove_queued(context.job_queue, job_name)
+    for job in broadcast_jobs(context.job_queue, chat_id):
+        job.data["chat_ids"].discard(chat_id)
+        if not job.data["chat_ids"]:
+            job.schedule_removal()
     
     schedules = context.bot_data.get("schedules")
     cleared_schedules = [sched for sched in schedules if sched[0]!=chat_id]
@@ -290,6 +460,25 @@ async def command_clear_schedule(update: Update, context: CallbackContext) -> No
     reply = "All scheduled tasks have been cleared."
     await context.bot.send_message(chat_id=chat_id, text=reply, disable_notification=True)
 
+async def command_schedule_shared(update: Update, context: CallbackContext) -> None:
+    """
+    Lets a chat opt in or out of receiving the same scheduled puzzle as other chats.
+    """
+    chat_id = update.effective_chat.id
+    unshared = context.bot_data.get("unshared_chats")
+    if context.args and context.args[0] in ("on", "off"):
+        if context.args[0] == "off" and chat_id not in unshared:
+            unshared.append(chat_id)
+        elif context.args[0] == "on" and chat_id in unshared:
+            unshared.remove(chat_id)
+    else:
+        reply = "Unrecognized arguments! Please follow the syntax: /schedule_shared <on/off>"
+        await context.bot.send_message(chat_id=chat_id, text=reply)
+        return
+    state = "the same as other chats" if chat_id not in unshared else "generated for this chat only"
+    reply = f"Scheduled puzzles will be {state}."
+    await context.bot.send_message(chat_id=chat_id, text=reply, disable_notification=True)
+
 # --------------------------- Admin Functions --------------------------- #
 
 async def admin_reset_schedule(update: Update, context: CallbackContext) -> None:
@@ -304,13 +493,64 @@ async def admin_reset_votechess(update: Update, context: CallbackContext) -> Non
     context.bot_data.update({"schedules": schedules})
     await context.bot.send_message(chat_id=chat_id, text="Votechess scheduling reset. Effective next restart.", disable_notification=True)
 
+async def admin_prefetch_stats(update: Update, context: CallbackContext) -> None:
+    """
+    Sends the prefetched puzzle counts and buffer hit/miss counters.
+    """
+    chat_id = update.effective_chat.id
+    stats = puzzle_buffer.stats()
+    reply = "\n".join([f"{task.value}: {s['buffered']} buffered, {s['hits']} hits, {s['misses']} misses"
+                       for task, s in stats.items()])
+    await context.bot.send_message(chat_id=chat_id, text=reply, disable_notification=True)
+
+async def admin_render_stats(update: Update, context: CallbackContext) -> None:
+    """
+    Sends the board render cache counters.
+    """
+    chat_id = update.effective_chat.id
+    from handlers.ChessHandler import RENDER_CACHE
+    reply = "\n".join([f"{key}: {value}" for key, value in RENDER_CACHE.stats().items()])
+    await context.bot.send_message(chat_id=chat_id, text=reply, disable_notification=True)
+
+async def admin_media_stats(update: Update, context: CallbackContext) -> None:
+    """
+    Sends the Telegram file_id registry counters.
+    """
+    chat_id = update.effective_chat.id
+    reply = "\n".join([f"{key}: {value}" for key, value in media_registry.stats().items()])
+    await context.bot.send_message(chat_id=chat_id, text=reply, disable_notification=True)
+
+async def admin_analysis_stats(update: Update, context: CallbackContext) -> None:
+    """
+    Sends the Stockfish analysis cache counters.
+    """
+    chat_id = update.effective_chat.id
+    reply = "\n".join([f"{key}: {value}" for key, value in chess_handler.analysis.stats().items()])
+    await context.bot.send_message(chat_id=chat_id, text=reply, disable_notification=True)
+
+async def admin_search_stats(update: Update, context: CallbackContext) -> None:
+    """
+    Sends the engine time budgets and the search depths reached for each call type.
+    """
+    chat_id = update.effective_chat.id
+    reply = "\n".join([f"{call_type}: " + ", ".join([f"{key} {value}" for key, value in stats.items()])
+                       for call_type, stats in chess_handler.search_stats().items()]) or "No searches yet."
+    await context.bot.send_message(chat_id=chat_id, text=reply, disable_notification=True)
+
+async def admin_startup_stats(update: Update, context: CallbackContext) -> None:
+    """
+    Sends how long each startup phase took.
+    """
+    chat_id = update.effective_chat.id
+    await context.bot.send_message(chat_id=chat_id, text=startup_timer.report(), disable_notification=True)
+
 async def admin_announcement(update: Update, context: CallbackContext) -> None:
     """
     Sends announcement to all chats with scheduled tasks
     """
     chat_ids = []
     for schedule in context.bot_data.get("schedules"):
-        chat_id, _, _ = schedule
+        chat_id = schedule[0]
         if chat_id not in chat_ids:
             chat_ids.append(chat_id)
             await context.bot.send_message(chat_id=chat_id, disable_notification=False,
@@ -334,6 +574,18 @@ async def save_bot_data(context: CallbackContext) -> None:
     r = redis.Redis(host=REDIS.hostname, port=REDIS.port, password=REDIS.password)
     bot_data_bytes = json.dumps(bot_data).encode('utf-8')
     r.set(TOKEN, bot_data_bytes)
+    r.set(TOKEN + ":media", json.dumps(media_registry.dump()).encode('utf-8'))
+
+
+async def check_engines(context: CallbackContext) -> None:
+    """
+    Restarts any Stockfish engine in the pool that has died.
+    """
+    if not chess_handler.is_ready():
+        return
+    restarted = await asyncio.to_thread(chess_handler.engines.health_check)
+    if restarted:
+        logging.warning(f"Restarted {restarted} Stockfish engine(s).")
 
 
 async def receive_poll_answer(update: Update, context: CallbackContext) -> None:
@@ -361,9 +613,19 @@ async def init_app(app: Application) -> None:
     """
     Initialize persistent data, reschedule tasks if needed
     """
-    bot_data = {Task.CHESS_VOTE.value: {}, Task.OTHELLO_VOTE.value: {}, "schedules": []}
+    startup_timer.mark("application initialized")
+    # Handlers load in the background, requests made meanwhile wait for them
+    chess_handler.start()
+    othello_handler.start()
+    app.job_queue.run_repeating(check_engines, interval=300, name="engine_health")
+    puzzle_buffer.start()
+    bot_data = {Task.CHESS_VOTE.value: {}, Task.OTHELLO_VOTE.value: {}, "schedules": [], "unshared_chats": []}
     app.bot_data.update(bot_data)
     r = redis.Redis(host=REDIS.hostname, port=REDIS.port, password=REDIS.password)
+    try:
+        media_registry.load(json.loads(r.get(TOKEN + ":media").decode('utf-8')))
+    except Exception:
+        logging.warning("No previous media file ids discovered.")
     try:
         bot_data_bytes = r.get(TOKEN)
         bot_data = json.loads(bot_data_bytes.decode('utf-8'))
@@ -373,7 +635,7 @@ async def init_app(app: Application) -> None:
         return
     
     for schedule in bot_data.get("schedules"):
-        chat_id, task, time_str = schedule
+        chat_id, task, time_str, *options = schedule
         job_name = task + str(chat_id)
         func = None
 
@@ -381,7 +643,7 @@ async def init_app(app: Application) -> None:
         minute = min(int(time_str[2:]),59)
         time = datetime.time(hour=hour, minute=minute, second=random.randint(0,30))
         if task == Task.CHESS_PUZZLE.value:
-            data = {"handler":chess_handler, "task":Task.CHESS_PUZZLE,}
+            data = {"handler":chess_handler, "task":Task.CHESS_PUZZLE, "options":options[0] if options else None}
             func = send_puzzle
         elif task == Task.CHESS_VOTE.value:
             data = {"handler":chess_handler, "task":Task.CHESS_VOTE,}
@@ -395,12 +657,16 @@ async def init_app(app: Application) -> None:
         else:
             continue
 
+        if BROADCAST and func is send_puzzle:
+            schedule_broadcast(app.job_queue, chat_id, data["handler"], data["task"], time, time_str, data.get("options"))
+            continue
         app.job_queue.run_daily(func, time=time, chat_id=chat_id,
                                     name=job_name, data=data)
     
     
     time = datetime.time(hour=3)
     app.job_queue.run_daily(save_bot_data, time=time, name="maintenance")
+    startup_timer.mark("jobs scheduled")
     
 
 
@@ -409,15 +675,44 @@ async def stop_app(app: Application) -> None:
     """
     Inform users that telegram bot is shutting down
     """
+    await puzzle_buffer.stop()
     bot_data = app.bot_data
     r = redis.Redis(host=REDIS.hostname, port=REDIS.port, password=REDIS.password)
     bot_data_bytes = json.dumps(bot_data).encode('utf-8')
     r.set(TOKEN, bot_data_bytes)
+    r.set(TOKEN + ":media", json.dumps(media_registry.dump()).encode('utf-8'))
+    if chess_handler.is_ready():
+        chess_handler.engines.close()
+    if othello_handler.is_ready():
+        othello_handler.close()
+    executor.shutdown()
     
 
 # --------------------------- Main --------------------------- #
 
 
+def load_chess_handler():
+    """
+    Downloads missing databases and engines, then starts the Stockfish pool. Runs in a worker thread.
+    """
+    import utils.setup as setup
+    from handlers.ChessHandler import ChessHandler
+    setup.setup()
+    startup_timer.mark("setup")
+    return ChessHandler(setup.STOCKFISH_PATH, setup.PUZZLE_STORE_PATH, setup.PUZZLE_INDEX_PATH, pool_size=ENGINE_POOL_SIZE,
+                        hash_mb=ENGINE_HASH, threads=ENGINE_THREADS, executor=executor,
+                        renderer=BOARD_RENDERER, book_path=setup.OPENING_BOOK_PATH,
+                        budgets={"puzzle": PUZZLE_BUDGET_MS, "vote": VOTE_BUDGET_MS, "cpu": CPU_BUDGET_MS})
+
+
+def load_othello_handler():
+    from handlers.OthelloHandler import OthelloHandler
+    from othello.minimax import search_workers
+    return OthelloHandler("data/othello_puzzles.csv", executor=executor, search_budget_ms=OTHELLO_BUDGET_MS,
+                          search_workers=search_workers(executor.processes, OTHELLO_SEARCH_WORKERS))
+
+
+
 def main() -> None:
     """
     Builds telegram application and runs it.
@@ -431,6 +726,7 @@ def main() -> None:
     app.add_handler(CommandHandler('schedule_view', command_get_schedule))
     app.add_handler(CommandHandler('schedule_clear', command_clear_schedule))
     app.add_handler(CommandHandler('schedule', command_set_schedule))
+    app.add_handler(CommandHandler('schedule_shared', command_schedule_shared))
     
     # Vote games
     app.add_handler(CommandHandler('votechess', command_chess_vote))
@@ -444,6 +740,12 @@ def main() -> None:
     app.add_handler(CommandHandler("announcement", admin_announcement, filters.Chat(username=ADMIN)))
     app.add_handler(CommandHandler("schedule_clearall", admin_reset_schedule, filters.Chat(username=ADMIN)))
     app.add_handler(CommandHandler("schedule_clearvotechess", admin_reset_votechess, filters.Chat(username=ADMIN)))
+    app.add_handler(CommandHandler("prefetch_stats", admin_prefetch_stats, filters.Chat(username=ADMIN)))
+    app.add_handler(CommandHandler("render_stats", admin_render_stats, filters.Chat(username=ADMIN)))
+    app.add_handler(CommandHandler("media_stats", admin_media_stats, filters.Chat(username=ADMIN)))
+    app.add_handler(CommandHandler("analysis_stats", admin_analysis_stats, filters.Chat(username=ADMIN)))
+    app.add_handler(CommandHandler("search_stats", admin_search_stats, filters.Chat(username=ADMIN)))
+    app.add_handler(CommandHandler("startup_stats", admin_startup_stats, filters.Chat(username=ADMIN)))
 
     # Background tasks
     app.add_handler(PollAnswerHandler(receive_poll_answer))
@@ -458,7 +760,12 @@ def main() -> None:
     )
 
 if __name__ == "__main__":
-    setup.setup()
-    chess_handler = ChessHandler(setup.STOCKFISH_PATH, setup.PUZZLE_PATH)
-    othello_handler = OthelloHandler("data/othello_puzzles.csv")
+    startup_timer = StartupTimer(START_TIME)
+    startup_timer.mark("imports")
+    executor = JobExecutor(processes=WORKER_PROCESSES, timeout=JOB_TIMEOUT)
+    chess_handler = LazyResource("chess handler", load_chess_handler, startup_timer)
+    media_registry = MediaRegistry(max_entries=MEDIA_REGISTRY_SIZE)
+    othello_handler = LazyResource("othello handler", load_othello_handler, startup_timer)
+    puzzle_buffer = PuzzleBuffer({Task.CHESS_PUZZLE: chess_handler, Task.OTHELLO_PUZZLE: othello_handler},
+                                 executor, size=PREFETCH_SIZE, low_water=PREFETCH_LOW_WATER)
     main()
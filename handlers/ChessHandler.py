@@ -1,41 +1,113 @@
 from cairosvg import svg2png
-import pandas as pd
-from stockfish import Stockfish
-import chess, chess.svg, random, tempfile, os
+from utils.engine_pool import EnginePool
+from utils.analysis_cache import AnalysisCache
+from utils.opening_book import OpeningBook
+from utils.puzzle_store import PuzzleStore
+from utils.render_cache import RenderCache
+from utils.sprite_renderer import SpriteRenderer
+from utils.animation import encode_gif
+import chess, chess.svg, random, io, logging, threading, time
 from copy import deepcopy
 from PIL import Image, ImageFile
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+RENDER_CACHE = RenderCache("./data/render_cache")
+SPRITE_RENDERER = None # Set by use_renderer("sprite")
+
 
 class ChessHandler:
     """
     Class for handling chess games and stockfish engine
     """
-    def __init__(self, stockfish_path, puzzle_path):
+    def __init__(self, stockfish_path, puzzle_path, index_path=None, pool_size=None, hash_mb=64, threads=1, executor=None,
+                 renderer="svg", analysis_path="./data/analysis_cache.db", book_path=None, budgets=None, min_budget_depth=10):
+        """
+            Parameters:
+                budgets (dict): wall-clock budget in milliseconds per call type ("puzzle", "vote", "cpu").
+                                Call types without a budget search to a fixed depth.
+                min_budget_depth (int): shallowest cached result reused by a budgeted search.
+        """
 
-        self.stockfish = Stockfish(path=stockfish_path,depth=15)
-        #self.stockfish.update_engine_parameters({"Hash": 128, "Threads": "4"})
+        self.engines = EnginePool(stockfish_path, size=pool_size, hash_mb=hash_mb, threads=threads, depth=15)
 
         self.puzzle_path = puzzle_path
-        self.puzzle_gen = self.puzzle_generator(self.puzzle_path)
-
+        self.puzzles = PuzzleStore(self.puzzle_path, index_path)
+        self.executor = executor
+        self.analysis = AnalysisCache(analysis_path)
+        self.book = OpeningBook(book_path)
+        self.budgets = budgets or {}
+        self.min_budget_depth = min_budget_depth
+        self.renderer = renderer # Selected again in the worker processes that render
+        self.depth_stats = {} # call type -> counters of engine searches
+        self.stats_lock = threading.Lock()
+        use_renderer(renderer)
+
+
+    def search(self, kind, board, rating, depth, multipv=1, call_type=None):
+        """
+        Runs a Stockfish search on the board, reusing cached analysis when possible.
+        If the call type has a budget, the search stops after that many milliseconds
+        and depth only caps it.
 
+            Parameters:
+                kind (str): "top_moves" for the best lines, "best_move" for the move played at rating.
+                board (chess.Board): position to search.
+                rating (int): elo of stockfish engine.
+                depth (int): search depth, or maximum depth of a budgeted search.
+                multipv (int): number of lines for "top_moves".
+                call_type (str): key of the budget to use.
 
-    def puzzle_generator(self, csv_path, rating=None):
+            Returns:
+                result (list or str): top moves in the get_top_moves format, or the best move in uci format.
         """
-        Generator that yields a random puzzle from the csv
+        budget = self.budgets.get(call_type)
+        min_depth = min(depth, self.min_budget_depth) if budget else depth
+        result = self.analysis.get(kind, board, rating, min_depth, multipv)
+        if result is not None:
+            return result
+
+        start = time.perf_counter()
+        with self.engines.engine() as stockfish:
+            stockfish.set_fen_position(board.fen())
+            stockfish.set_elo_rating(rating)
+            if budget:
+                top_moves, best_move, reached = stockfish.search(multipv, movetime=budget, depth=depth)
+                result = top_moves if kind == "top_moves" else best_move
+            else:
+                stockfish.set_depth(depth)
+                result = stockfish.get_top_moves(multipv) if kind == "top_moves" else stockfish.get_best_move()
+                reached = depth
+        self.record_search(call_type, reached, time.perf_counter() - start)
+        if reached:
+            self.analysis.put(kind, board, rating, reached, result, multipv)
+        return result
+
+
+    def record_search(self, call_type, depth, seconds):
+        logging.debug(f"{call_type} search reached depth {depth} in {seconds * 1000:.0f} ms.")
+        with self.stats_lock:
+            stats = self.depth_stats.setdefault(call_type, {"searches": 0, "depth_sum": 0, "min_depth": depth,
+                                                            "max_depth": depth, "max_ms": 0})
+            stats["searches"] += 1
+            stats["depth_sum"] += depth
+            stats["min_depth"] = min(stats["min_depth"], depth)
+            stats["max_depth"] = max(stats["max_depth"], depth)
+            stats["max_ms"] = max(stats["max_ms"], round(seconds * 1000))
+
+
+    def search_stats(self):
         """
-        p = 0.01
-        df = pd.read_csv(csv_path, skiprows=lambda i: i>0 and random.random() > p)
-        for _, row in df.iterrows():
-            FEN = row["FEN"]
-            moves = row["Moves"]
-            puzzle_rating = row["Rating"]
-
-            yield FEN, moves, puzzle_rating
+        Returns the budget, average/min/max depth reached and slowest search of each call type.
+        """
+        with self.stats_lock:
+            return {call_type: {"budget_ms": self.budgets.get(call_type), "searches": stats["searches"],
+                                "avg_depth": stats["depth_sum"] / stats["searches"], "min_depth": stats["min_depth"],
+                                "max_depth": stats["max_depth"], "max_ms": stats["max_ms"]}
+                    for call_type, stats in self.depth_stats.items()}
 
 
-    def get_mcq_choices(self, board, solution_san=None, choices_count=4, top_moves_count=5, rating=2500, depth=18):
+    def get_mcq_choices(self, board, solution_san=None, choices_count=4, top_moves_count=5, rating=2500, depth=18,
+                        call_type="vote"):
         """
         Generates possible moves from a chess board.
 
@@ -44,19 +116,21 @@ class ChessHandler:
                 solution_san (str): The best move in san format.
                 choices_count (int): The number of choices to return.
                 top_moves_count (int): The number of possible moves to generate.
+                call_type (str): budget used by the search, see ChessHandler.search.
             
             Returns:
                 choices (list): list of possible moves in san format.
                 solution_ind (int): index of the solution/best move.
         """
-        FEN = board.fen()
-        self.stockfish.set_fen_position(FEN)
-        self.stockfish.set_elo_rating(rating)
-        self.stockfish.set_depth(depth)
-        top_moves = self.stockfish.get_top_moves(top_moves_count)
-        if len(top_moves) == 0:
-            return ["Error", "No legal moves found", 0]
-        choices = [uci_to_san(board, top_moves[i]["Move"]) for i, _ in enumerate(top_moves)]
+        book_entries = [] if solution_san else self.book.entries(board)[:top_moves_count]
+        if len(book_entries) >= 2:
+            # In the opening the most played book move is the solution
+            choices = [board.san(entry.move) for entry in book_entries]
+        else:
+            top_moves = self.search("top_moves", board, rating, depth, top_moves_count, call_type)
+            if len(top_moves) == 0:
+                return ["Error", "No legal moves found", 0]
+            choices = [uci_to_san(board, top_moves[i]["Move"]) for i, _ in enumerate(top_moves)]
 
         if not solution_san:
             solution_san = choices[0]
@@ -75,38 +149,63 @@ class ChessHandler:
         return choices, solution_ind
 
 
-    def cpu_move(self, board, rating=1300, depth=11):
+    def cpu_move(self, board, rating=1300, depth=11, call_type="cpu"):
         """
-        Plays the best possible move using stockfish engine.
+        Plays a weighted random book move, or the best possible move using stockfish engine.
 
             Parameters:
                 board (chess.Board): current state of the board.
                 rating (int): elo of stockfish engine.
+                call_type (str): budget used by the search, see ChessHandler.search.
 
             Returns:
                 board (chess.Board): new state of board.
         """
 
-        FEN = board.fen()
-        self.stockfish.set_fen_position(FEN)
-        self.stockfish.set_elo_rating(rating)
-        self.stockfish.set_depth(depth)
-        cpu_move = self.stockfish.get_best_move()
+        book_move = self.book.choose(board)
+        if book_move:
+            board.push(book_move)
+            return board
+
+        cpu_move = self.search("best_move", board, rating, depth, call_type=call_type)
         move = chess.Move.from_uci(cpu_move)
         board.push(move)
 
         return board
 
 
-    def generate_puzzle(self):
+    def generate_puzzle(self, rating=None, theme=None):
         """
         Generates a random puzzle with arguments for telegram poll format.
+
+            Parameters:
+                rating (int): preferred puzzle rating, None for any rating.
+                theme (str): Lichess puzzle theme, None for any theme.
+
+            Returns:
+                puzzle (tuple): board image, choices, solution index, prompt, explanation and solution video,
+                                None if no puzzle has the theme.
         """
-        try:
-            FEN, moves, puzzle_rating = next(self.puzzle_gen)
-        except Exception:
-            self.puzzle_gen = self.puzzle_generator(self.puzzle_path)
-            FEN, moves, puzzle_rating = next(self.puzzle_gen)
+        puzzle = self.puzzle_position(rating, theme)
+        if puzzle is None:
+            return None
+        board, solution_line, puzzle_rating, choices, solution_ind, prompt = puzzle
+        board_img, explanation, solution_video = render_puzzle(board, solution_line, puzzle_rating)
+        return board_img, choices, solution_ind, prompt, explanation, solution_video
+
+
+    def puzzle_position(self, rating=None, theme=None):
+        """
+        Picks a puzzle and its choices, everything generate_puzzle does except rendering.
+
+            Returns:
+                position (tuple): board after the first move, solution line in uci format, puzzle rating,
+                                  choices, solution index and prompt. None if no puzzle has the theme.
+        """
+        puzzle = self.puzzles.sample(rating, theme)
+        if puzzle is None:
+            return None
+        FEN, moves, puzzle_rating, distractors = puzzle
         solution_line = moves.split(" ")
         first_move = solution_line.pop(0)
         board = chess.Board(FEN)
@@ -118,15 +217,16 @@ class ChessHandler:
         solution_uci = solution_line[0]
         solution_san = uci_to_san(board, solution_uci)
 
-        choices, solution_ind = self.get_mcq_choices(board, solution_san, rating=2000, depth=13)
+        if distractors is not None:
+            # Precomputed by utils.analyse_puzzles, no engine call needed
+            choices, solution_ind = shuffle_choices([uci_to_san(board, move) for move in distractors], solution_san)
+        else:
+            choices, solution_ind = self.get_mcq_choices(board, solution_san, rating=2000, depth=13,
+                                                         call_type="puzzle")
 
         turn = "White" if board.turn else "Black"
         prompt = f"\U0001F9E9 Chess Puzzle \U0001F9E9\n{turn} to move."
-
-        solution_video, solution_line_san = ChessHandler.generate_solution_video(deepcopy(board), solution_line)
-        explanation = "Solution line: " + ", ".join(solution_line_san) + f"\n Rating: {puzzle_rating}"
-        board_img, _ = get_board_img(board)
-        return board_img, choices, solution_ind, prompt, explanation, solution_video
+        return board, solution_line, puzzle_rating, choices, solution_ind, prompt
 
 
     def new_votechess(self):
@@ -140,18 +240,24 @@ class ChessHandler:
                 prompt (str): string prompt to be sent with telegram poll.
                 board (chess.Board): updated board state
         """
+        board, choices, solution_ind, prompt = self.new_votechess_position()
+        return render_board(board), choices, solution_ind, prompt, board.fen()
+
+
+    def new_votechess_position(self):
+        """
+        Returns the board, choices, solution index and prompt of new_votechess, without the image.
+        """
         board = chess.Board()
         # Randomize starting player
         if random.choice([True, False]):
             board = self.cpu_move(board,rating=2000,depth=7)
 
-        board_img, _ = get_board_img(board)
-
         turn = "White" if board.turn else "Black"
         prompt = f"{turn} to move"
         choices, solution_ind = self.get_mcq_choices(board, choices_count=3, top_moves_count=7, rating=2000, depth=7)
         prompt = "\U0001F4CA Vote Chess \U0001F4CA\n" + prompt
-        return board_img, choices, solution_ind, prompt, board.fen()
+        return board, choices, solution_ind, prompt
 
 
     def generate_votechess(self, fen, move=None, opponent_rating=2000):
@@ -169,6 +275,14 @@ class ChessHandler:
                 prompt (str): string prompt to be sent with telegram poll.
                 board (chess.Board): updated board state
 
+        """
+        board, choices, solution_ind, prompt = self.votechess_position(fen, move, opponent_rating)
+        return render_board(board), choices, solution_ind, prompt, board.fen()
+
+
+    def votechess_position(self, fen, move=None, opponent_rating=2000):
+        """
+        Returns the board, choices, solution index and prompt of generate_votechess, without the image.
         """
         board = chess.Board(fen)
         player_turn = board.turn
@@ -205,7 +319,35 @@ class ChessHandler:
 
 
         prompt = "\U0001F4CA Vote Chess \U0001F4CA\n" + prompt
-        board_img, _ = get_board_img(board)
+        return board, choices, solution_ind, prompt
+
+
+    # Awaitable API. Stockfish searches already run in the engine processes, so the python side
+    # only waits on pipes in the thread pool. Rendering holds the GIL and goes to the process pool.
+    async def generate_puzzle_async(self, rating=None, theme=None, timeout=None):
+        deadline = time.perf_counter() + timeout if timeout else None
+        puzzle = await self.executor.run_thread(self.puzzle_position, rating, theme, timeout=timeout)
+        if puzzle is None:
+            return None
+        board, solution_line, puzzle_rating, choices, solution_ind, prompt = puzzle
+        board_img, explanation, solution_video = await self.executor.run_process(
+            render_puzzle, board, solution_line, puzzle_rating, self.renderer, timeout=time_left(deadline))
+        return board_img, choices, solution_ind, prompt, explanation, solution_video
+
+
+    async def new_votechess_async(self, timeout=None):
+        deadline = time.perf_counter() + timeout if timeout else None
+        board, choices, solution_ind, prompt = await self.executor.run_thread(self.new_votechess_position,
+                                                                              timeout=timeout)
+        board_img = await self.executor.run_process(render_board, board, self.renderer, timeout=time_left(deadline))
+        return board_img, choices, solution_ind, prompt, board.fen()
+
+
+    async def generate_votechess_async(self, fen, move=None, timeout=None):
+        deadline = time.perf_counter() + timeout if timeout else None
+        board, choices, solution_ind, prompt = await self.executor.run_thread(self.votechess_position, fen, move,
+                                                                              timeout=timeout)
+        board_img = await self.executor.run_process(render_board, board, self.renderer, timeout=time_left(deadline))
         return board_img, choices, solution_ind, prompt, board.fen()
 
 
@@ -214,21 +356,76 @@ class ChessHandler:
         solution_line_san = []
         turn = not board.turn
         images = []
-        filename = "solution.gif"
 
         _, first_im = get_board_img(board, pov=turn)
 
-        for move in solution_line:
-            solution_line_san.append(uci_to_san(board, move))
-            board.push(chess.Move.from_uci(move))
-            _, im = get_board_img(board, pov=turn)
-            images.append(im)
+        if SPRITE_RENDERER:
+            moves = [chess.Move.from_uci(move) for move in solution_line]
+            san_board = board.copy()
+            for move in moves:
+                solution_line_san.append(san_board.san(move))
+                san_board.push(move)
+            images = SPRITE_RENDERER.render_line(board, moves, turn)
+        else:
+            for move in solution_line:
+                solution_line_san.append(uci_to_san(board, move))
+                board.push(chess.Move.from_uci(move))
+                _, im = get_board_img(board, pov=turn)
+                images.append(im)
 
-        first_im.save(filename, save_all=True, append_images=images, duration=900, loop=0)
-        solution_video = open(filename, "rb")
+        solution_video = encode_gif([first_im] + images, duration=900, loop=0)
         return solution_video, solution_line_san
 
     # Static functions
+def time_left(deadline):
+    """Returns the seconds left before deadline for the next job, None to use the executor's timeout"""
+    return None if deadline is None else max(deadline - time.perf_counter(), 0)
+
+
+def render_puzzle(board, solution_line, puzzle_rating, renderer=None):
+    """
+    Renders the board image, the solution animation and the explanation of a puzzle.
+    Also runs in worker processes, where renderer selects the board renderer of that process.
+
+        Returns:
+            board_img (bytes): png encoded image.
+            explanation (str): solution line in san format and puzzle rating.
+            solution_video (bytes): gif encoded animation.
+    """
+    if renderer:
+        use_renderer(renderer)
+    solution_video, solution_line_san = ChessHandler.generate_solution_video(deepcopy(board), solution_line)
+    explanation = "Solution line: " + ", ".join(solution_line_san) + f"\n Rating: {puzzle_rating}"
+    board_img, _ = get_board_img(board)
+    return board_img, explanation, solution_video
+
+
+def render_board(board, renderer=None):
+    """
+    Returns the png bytes of the board. Also runs in worker processes, see render_puzzle.
+    """
+    if renderer:
+        use_renderer(renderer)
+    board_img, _ = get_board_img(board)
+    return board_img
+
+
+def shuffle_choices(distractors, solution_san, choices_count=4):
+    """
+    Picks wrong answers at random and inserts the solution at a random position.
+
+        Returns:
+            choices (list): list of possible moves in san format.
+            solution_ind (int): index of the solution.
+    """
+    choices = random.sample(distractors, min(choices_count - 1, len(distractors)))
+    solution_ind = random.randint(0, len(choices))
+    choices.insert(solution_ind, solution_san)
+    if len(choices) == 1:
+        choices = choices * 2
+    return choices, solution_ind
+
+
 def uci_to_san(board:chess.Board, uci:str):
     """
     Given a board state, converts move from UCI format to SAN format.
@@ -238,9 +435,28 @@ def uci_to_san(board:chess.Board, uci:str):
     return san
 
 
-def get_board_img(board: chess.Board, pov=None):
+def use_renderer(name):
+    """
+    Selects the board renderer: "svg" rasterises chess.svg boards with cairosvg,
+    "sprite" composites pre-rasterised sprites with the same look.
+    """
+    global SPRITE_RENDERER
+    if name == "sprite":
+        if SPRITE_RENDERER is None:
+            SPRITE_RENDERER = SpriteRenderer()
+    elif name == "svg":
+        SPRITE_RENDERER = None
+    else:
+        raise ValueError(f"Unknown board renderer {name}")
+
+
+def get_board_img(board: chess.Board, pov=None, size=None):
     """
     Renders a png image from a board state.
+
+        Returns:
+            im_bytes (bytes): png encoded image.
+            im (PIL.Image): decoded image.
     """
     try:
         last_move = board.peek()
@@ -249,13 +465,15 @@ def get_board_img(board: chess.Board, pov=None):
     if pov is None:
         pov = not board.turn
 
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        boardsvg = chess.svg.board(board=board,flipped = pov, lastmove = last_move)
-        temp_path = os.path.join(tmpdirname, "board.png")
-        svg2png(bytestring=boardsvg,write_to=temp_path)
-        im = Image.open(temp_path)
-        im_bytes = open(temp_path, "rb")
-        
-        return im_bytes, im
-
-
+    renderer = "sprite" if SPRITE_RENDERER else "svg"
+    key = (board.board_fen(), pov, last_move.uci() if last_move else None, size, renderer)
+    im_bytes = RENDER_CACHE.get(key)
+    if im_bytes is None:
+        if SPRITE_RENDERER and size in (None, SPRITE_RENDERER.size):
+            im_bytes = SPRITE_RENDERER.render_png(board, pov, last_move)
+        else:
+            boardsvg = chess.svg.board(board=board, flipped=pov, lastmove=last_move, size=size)
+            im_bytes = svg2png(bytestring=boardsvg)
+        RENDER_CACHE.put(key, im_bytes)
+    im = Image.open(io.BytesIO(im_bytes))
+    return im_bytes, im
@@ -1,17 +1,25 @@
 from othello.board import Board
 from othello import minimax
+from utils.executor import call_handler
+from utils.animation import encode_gif
+from othello.renderer import get_renderer
 from copy import deepcopy
 import pandas as pd
-import random
+import random, threading
 
 class OthelloHandler:
     """
     Class for handling chess games and stockfish engine
     """
-    def __init__(self, puzzle_path):
+    def __init__(self, puzzle_path, executor=None, search_budget_ms=0, search_workers=1):
 
         self.puzzle_path = puzzle_path
+        self.executor = executor
+        self.time_limit = search_budget_ms / 1000 or None # Seconds per move search, None to search to full depth
+        self.search_workers = search_workers # Processes each search spreads its root moves over
+        self.init_args = (puzzle_path, None, search_budget_ms, search_workers) # Rebuilds this handler in worker processes
         self.puzzle_gen = self.puzzle_generator(self.puzzle_path)
+        self.puzzle_lock = threading.Lock()
 
     
     def puzzle_generator(self, csv_path):
@@ -30,11 +38,12 @@ class OthelloHandler:
 
 
     def generate_puzzle(self):
-        try:
-            board_state, solution, choices, evaluations, solution_line = next(self.puzzle_gen)
-        except Exception:
-            self.puzzle_gen = self.puzzle_generator(self.puzzle_path)
-            board_state, solution, choices, evaluations, solution_line = next(self.puzzle_gen)
+        with self.puzzle_lock:
+            try:
+                board_state, solution, choices, evaluations, solution_line = next(self.puzzle_gen)
+            except Exception:
+                self.puzzle_gen = self.puzzle_generator(self.puzzle_path)
+                board_state, solution, choices, evaluations, solution_line = next(self.puzzle_gen)
         b = Board(board_state)
         explanation = ", ".join([f"{move}: {eval}" for move, eval in zip([solution] + choices, evaluations)]) +\
                         f"\n\nSolution line: {solution_line}"
@@ -51,7 +60,9 @@ class OthelloHandler:
 
     def get_mcq_choices(self, board, solution_san=None, choices_count=4, top_moves_count=5, depth=4):
         
-        choices = minimax.find_best_moves(board, n=top_moves_count)
+        # Choices only need to tell winning moves from losing ones, not the exact margins
+        choices = minimax.find_best_moves(board, n=top_moves_count, time_limit=self.time_limit,
+                                          workers=self.search_workers, exact=False)
         #choices = [x["move"] for x in choices]
         if len(choices) == 0:
             return ["Error", "No legal moves found", 0]
@@ -77,7 +88,7 @@ class OthelloHandler:
         cpu_turn = board.turn
         while board.turn == cpu_turn and not board.check_game_over():
 
-            best_moves = minimax.find_best_moves(board,n=4)
+            best_moves = minimax.find_best_moves(board, n=4, time_limit=self.time_limit, workers=self.search_workers)
             best_moves = [x["move"] for x in best_moves]
             weights = [100, 20, 10, 5]
             #cpu_move = random.choices(best_moves, weights = weights[:len(best_moves)])[0]
@@ -147,21 +158,34 @@ class OthelloHandler:
         return board_img, choices, solution_ind, prompt, board.get_board_state()
         
 
-    @staticmethod
-    def generate_solution_video(board, solution_line):
-        images = []
-        filename = "solution.gif"
+    # Awaitable API. Minimax is pure python, so each job runs on an
+    # OthelloHandler living in a worker process of the executor's process pool.
+    async def generate_puzzle_async(self, timeout=None):
+        return await self.executor.run_process(call_handler, OthelloHandler, self.init_args,
+                                               "generate_puzzle", timeout=timeout)
 
-        _, first_im = board.get_board_img()
 
-        moves = solution_line.split(" ")
-        for move in moves:
-            board.push(move)
-            _, im = board.get_board_img()
-            images.append(im)
+    async def new_votechess_async(self, timeout=None):
+        return await self.executor.run_process(call_handler, OthelloHandler, self.init_args,
+                                               "new_votechess", timeout=timeout)
+
+
+    async def generate_votechess_async(self, board_state, move=None, timeout=None):
+        return await self.executor.run_process(call_handler, OthelloHandler, self.init_args,
+                                               "generate_votechess", (board_state, move), timeout=timeout)
+
+
+    def close(self):
+        # Worker processes stop their own search pools when they exit
+        minimax.shutdown_search_pools()
+
+
+    @staticmethod
+    def generate_solution_video(board, solution_line):
+        renderer = get_renderer()
+        first_im = renderer.render(*board.bitboards())
+        images = renderer.render_line(board, solution_line.split(" "))
 
-        first_im.save(filename, save_all=True, append_images=images, duration=900, loop=0)
-        solution_video = open(filename, "rb")
-        return solution_video
+        return encode_gif([first_im] + images, duration=900, loop=0)
 
 
@@ -1,8 +1,11 @@
+from othello.transposition import zobrist_bits, zobrist_hash, FLIP_TABLES, BLACK_KEYS, WHITE_KEYS, WHITE_TO_MOVE
+from othello.renderer import get_renderer
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
-import os, tempfile
+import os
 
-class Board:
+BACKEND = os.environ.get("OTHELLO_BOARD", "bitboard") # "bitboard" or "array"
+
+class ArrayBoard:
     WHITE =  -1
     BLACK =  1
     EMPTY =  0
@@ -25,7 +28,8 @@ class Board:
         for _ in range(3):                              # increasing rows till 8
             self.board = np.concatenate((self.board, self.board), axis = 0)
         self.black_disc_count = self.white_disc_count = 0
-        
+        self.stack = []     # undo records of pushed moves
+
         if not board_state:
             self.reset_board()
         else:
@@ -61,6 +65,10 @@ class Board:
         
         return all_legal_moves
 
+    def mobility(self, PLAYER: int=None) -> int:
+        '''Return the number of legal moves of the player'''
+        return len(self.all_legal_moves(PLAYER))
+
     def legal_moves(self, r: int, c: int) -> list:
         '''Return all legal moves for the cell at the given position'''
 
@@ -136,16 +144,24 @@ class Board:
 
 
     def push(self, move:str|tuple):
+        '''Play a move in place, keeping an undo record for pop'''
         if isinstance(move, str):
             x, y = Board.move2coord(move)
         elif isinstance(move, tuple):
             x, y = move
+        self.stack.append((self.board.copy(), self.turn, self.black_disc_count, self.white_disc_count, self.hash))
         self.set_discs(x,y,self.turn)
         self.turn *= -1
         self.move += 1
 
         if len(self.all_legal_moves()) == 0:
             self.turn *= -1
+        self.rehash()
+
+    def pop(self) -> None:
+        '''Undo the last pushed move'''
+        self.board, self.turn, self.black_disc_count, self.white_disc_count, self.hash = self.stack.pop()
+        self.move -= 1
 
 
     def print_board(self) -> None:
@@ -153,39 +169,8 @@ class Board:
 
 
     def get_board_img(self, moves=None):
-        im = Image.open("./othello/othello_board.png")
-        draw = ImageDraw.Draw(im)
-        border_size = 34
-        tile_size = 75
-        tile_buffer = 3
-
-        for r, row in enumerate(self.board):
-            for c, tile in enumerate(row):
-                x1 = border_size + c*tile_size + tile_buffer
-                y1 = border_size + r*tile_size + tile_buffer
-                x2 = border_size + (c+1)*tile_size - tile_buffer
-                y2 = border_size + (r+1)*tile_size - tile_buffer
-                if tile == Board.WHITE:
-                    fill = "white"
-                elif tile == Board.BLACK:
-                    fill = "black"
-                else:
-                    continue
-                draw.ellipse((x1, y1, x2, y2), fill = fill, outline ='black')
-        if moves:
-            font = ImageFont.truetype("othello/ARIAL.TTF", size=40)
-            for move in moves:
-                r, c = move["coord"]
-                eval_str = str(int(move["eval"]))
-                x1 = border_size + c*tile_size + tile_buffer
-                y1 = border_size + r*tile_size + tile_buffer
-                draw.text((x1,y1,x2,y2),eval_str, fill="orange", font=font)
-            
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            temp_path = os.path.join(tmpdirname, "board.png")
-            im.save(temp_path)
-            im_bytes = open(temp_path, "rb")
-            return im_bytes, im
+        '''Return the png bytes and the image of the board, with the evaluations of moves written on their squares'''
+        return get_renderer().render_png(*self.bitboards(), moves)
 
 
     def get_score(self) -> dict:
@@ -208,6 +193,7 @@ class Board:
 
         self.black_disc_count = self.white_disc_count = 2
         self.turn = Board.BLACK
+        self.rehash()
 
     def check_game_over(self) -> bool:
         possibleBlackMoves = self.all_legal_moves(Board.BLACK)
@@ -230,6 +216,7 @@ class Board:
         self.black_disc_count = self.board[self.board > 0].sum()
         self.white_disc_count = -self.board[self.board < 0].sum()
         self.move = self.white_disc_count + self.black_disc_count - 4
+        self.rehash()
 
 
     def get_board_state(self):
@@ -238,4 +225,218 @@ class Board:
         board_state = board_state + " " + mapping[self.turn]
         return board_state
 
-    
+    def bitboards(self) -> tuple:
+        '''Return the (black, white) discs as 64 bit masks, square r*8 + c is bit r*8 + c'''
+        flat = self.board.flatten()
+        black = np.packbits(flat == Board.BLACK, bitorder="little").view("<u8")[0]
+        white = np.packbits(flat == Board.WHITE, bitorder="little").view("<u8")[0]
+        return int(black), int(white)
+
+    def rehash(self) -> None:
+        '''Recompute the Zobrist hash of the position from scratch'''
+        self.hash = zobrist_hash(*self.bitboards(), self.turn == Board.WHITE)
+
+
+FULL = 0xFFFFFFFFFFFFFFFF
+NOT_A_FILE = 0xFEFEFEFEFEFEFEFE # Clears column 0 ("a") after a shift towards higher columns
+NOT_H_FILE = 0x7F7F7F7F7F7F7F7F # Clears column 7 ("h") after a shift towards lower columns
+# Square r*8 + c is bit r*8 + c. Each direction is a (shift, mask) pair, positive shifts go left.
+SHIFTS = ((1, NOT_A_FILE), (-1, NOT_H_FILE), (8, FULL), (-8, FULL),
+          (9, NOT_A_FILE), (7, NOT_H_FILE), (-7, NOT_A_FILE), (-9, NOT_H_FILE))
+
+
+def shift(bits, amount, mask):
+    if amount > 0:
+        return (bits << amount) & mask & FULL
+    return (bits >> -amount) & mask
+
+
+LEFT_SHIFTS = tuple((amount, mask) for amount, mask in SHIFTS if amount > 0)
+RIGHT_SHIFTS = tuple((-amount, mask) for amount, mask in SHIFTS if amount < 0)
+
+
+def legal_moves_mask(player, opponent):
+    '''Return the bitboard of empty squares where player can move'''
+    # Fills up to 6 opponent discs per direction, the second half two squares at a time
+    empty = ~(player | opponent) & FULL
+    moves = 0
+    for amount, mask in LEFT_SHIFTS:
+        pro = opponent & mask
+        x = pro & (player << amount)
+        x |= pro & (x << amount)
+        pro2 = pro & (pro << amount)
+        x |= pro2 & (x << 2*amount)
+        x |= pro2 & (x << 2*amount)
+        moves |= (x << amount) & mask & empty
+    for amount, mask in RIGHT_SHIFTS:
+        pro = opponent & mask
+        x = pro & (player >> amount)
+        x |= pro & (x >> amount)
+        pro2 = pro & (pro >> amount)
+        x |= pro2 & (x >> 2*amount)
+        x |= pro2 & (x >> 2*amount)
+        moves |= (x >> amount) & mask & empty
+    return moves
+
+
+def flips_mask(square, player, opponent):
+    '''Return the bitboard of opponent discs flipped by player moving on square'''
+    flips = 0
+    move = 1 << square
+    for amount, mask in SHIFTS:
+        line = 0
+        x = shift(move, amount, mask)
+        while x & opponent:
+            line |= x
+            x = shift(x, amount, mask)
+        if x & player:
+            flips |= line
+    return flips
+
+
+def mask_to_coords(bits):
+    coords = set()
+    while bits:
+        low = bits & -bits
+        coords.add(divmod(low.bit_length() - 1, 8))
+        bits ^= low
+    return coords
+
+
+class BitBoard(ArrayBoard):
+    '''Othello board stored as two 64 bit integers, one per colour, with shift-and-mask move generation.
+    Same API as ArrayBoard, `board` is rebuilt as an 8x8 numpy array on access.'''
+
+    def __init__(self, board_state=None) -> None:
+        self.black = self.white = 0
+        self.move = 0
+        self.turn = Board.BLACK
+        self.hash = 0       # Zobrist hash, updated incrementally by push
+        self.stack = []
+        if not board_state:
+            self.reset_board()
+        else:
+            self.set_board_state(board_state)
+
+    @property
+    def board(self):
+        bits = np.unpackbits(np.array([self.black, self.white], dtype="<u8").view(np.uint8), bitorder="little")
+        return (bits[:64].astype(np.int8) - bits[64:].astype(np.int8)).reshape(8, 8)
+
+    @property
+    def black_disc_count(self):
+        return self.black.bit_count()
+
+    @property
+    def white_disc_count(self):
+        return self.white.bit_count()
+
+    def discs(self, PLAYER: int) -> tuple:
+        '''Return the (player, opponent) bitboards'''
+        if PLAYER == Board.BLACK:
+            return self.black, self.white
+        return self.white, self.black
+
+    def set_discs_mask(self, PLAYER: int, player: int, opponent: int) -> None:
+        if PLAYER == Board.BLACK:
+            self.black, self.white = player, opponent
+        else:
+            self.white, self.black = player, opponent
+
+    def legal_moves_mask(self, PLAYER: int=None) -> int:
+        return legal_moves_mask(*self.discs(PLAYER or self.turn))
+
+    def all_legal_moves(self, PLAYER: int=None) -> set:
+        '''Return all legal moves for the player'''
+        return mask_to_coords(self.legal_moves_mask(PLAYER))
+
+    def mobility(self, PLAYER: int=None) -> int:
+        return self.legal_moves_mask(PLAYER).bit_count()
+
+    def legal_moves(self, r: int, c: int) -> list:
+        '''Return all legal moves for the cell at the given position'''
+        square = 1 << (r*8 + c)
+        if self.black & square:
+            player, opponent = self.black, self.white
+        elif self.white & square:
+            player, opponent = self.white, self.black
+        else:
+            return []
+        return list(mask_to_coords(legal_moves_mask(square, opponent) & ~player))
+
+    def flipDiscs(self, PLAYER: int, initCoords: tuple[int, int], endCoords: tuple[int, int], direction: tuple[int, int]):
+        '''Flip the discs between the given two cells to the given PLAYER color.'''
+        rowDir, colDir = direction
+        row, col = initCoords
+        row += rowDir
+        col += colDir
+        player, opponent = self.discs(PLAYER)
+        while (row, col) != tuple(endCoords) and opponent & (1 << (row*8 + col)):
+            player |= 1 << (row*8 + col)
+            opponent &= ~(1 << (row*8 + col))
+            row += rowDir
+            col += colDir
+        self.set_discs_mask(PLAYER, player, opponent)
+        self.rehash()
+
+    def set_discs(self, row: int, col: int, PLAYER: int=None) -> None:
+        '''Set the discs on the board as per the move made on the given cell'''
+        if not PLAYER:
+            PLAYER = self.turn
+        square = row*8 + col
+        player, opponent = self.discs(PLAYER)
+        flips = flips_mask(square, player, opponent)
+        self.set_discs_mask(PLAYER, player | flips | (1 << square), opponent & ~flips)
+        self.hash ^= zobrist_bits(flips, FLIP_TABLES) ^ (BLACK_KEYS if PLAYER == Board.BLACK else WHITE_KEYS)[square]
+
+    def push(self, move:str|tuple):
+        '''Play a move in place, keeping an undo record for pop'''
+        if isinstance(move, str):
+            x, y = Board.move2coord(move)
+        elif isinstance(move, tuple):
+            x, y = move
+        self.stack.append((self.black, self.white, self.turn, self.hash))
+        self.set_discs(x, y, self.turn)
+        self.turn *= -1
+        self.move += 1
+
+        if not self.legal_moves_mask(self.turn):
+            self.turn *= -1
+        else:
+            self.hash ^= WHITE_TO_MOVE
+
+    def pop(self) -> None:
+        '''Undo the last pushed move'''
+        self.black, self.white, self.turn, self.hash = self.stack.pop()
+        self.move -= 1
+
+    def reset_board(self) -> None:
+        self.white = 1 << (3*8 + 3) | 1 << (4*8 + 4)
+        self.black = 1 << (3*8 + 4) | 1 << (4*8 + 3)
+        self.turn = Board.BLACK
+        self.rehash()
+
+    def check_game_over(self) -> bool:
+        return not (legal_moves_mask(self.black, self.white) or legal_moves_mask(self.white, self.black))
+
+    def set_board_state(self, board_state:str):
+        mapping = {"b":Board.BLACK, "w":Board.WHITE, "x":Board.EMPTY}
+        self.turn = mapping[board_state[-1]]
+        self.black = self.white = 0
+        for square in range(64):
+            if board_state[square] == "b":
+                self.black |= 1 << square
+            elif board_state[square] == "w":
+                self.white |= 1 << square
+        self.move = self.white_disc_count + self.black_disc_count - 4
+        self.rehash()
+
+    def get_board_state(self):
+        tiles = ["b" if self.black >> square & 1 else "w" if self.white >> square & 1 else "x" for square in range(64)]
+        return "".join(tiles) + " " + ("b" if self.turn == Board.BLACK else "w")
+
+    def bitboards(self) -> tuple:
+        return self.black, self.white
+
+
+Board = BitBoard if BACKEND == "bitboard" else ArrayBoard
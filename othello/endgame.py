@@ -0,0 +1,151 @@
+from othello.board import FULL, NOT_A_FILE, NOT_H_FILE, legal_moves_mask, flips_mask
+import time
+
+FASTEST_FIRST_EMPTIES = 6 # Below this many empty squares, ordering by mobility costs more than it saves
+STABILITY_ALPHA = 8 # Edge stability can only prove scores below 64 - 2*28, so it is not tried for lower alpha
+
+QUADRANTS = (0x000000000F0F0F0F, 0x00000000F0F0F0F0, 0x0F0F0F0F00000000, 0xF0F0F0F000000000)
+CORNERS = 1 | 1 << 7 | 1 << 56 | 1 << 63
+TOP_BOTTOM_EDGES = 0xFF | 0xFF << 56
+LEFT_RIGHT_EDGES = 0x0101010101010101 | 0x8080808080808080
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def stable_discs(bits: int) -> int:
+    '''Return the edge discs that can never be flipped: those joined to an own corner along the edge'''
+    stable = bits & CORNERS
+    if not stable:
+        return 0
+    for _ in range(6):
+        grown = ((stable << 1) & NOT_A_FILE | (stable >> 1) & NOT_H_FILE) & TOP_BOTTOM_EDGES \
+                | ((stable << 8) | (stable >> 8)) & LEFT_RIGHT_EDGES
+        grown = stable | (grown & bits & FULL)
+        if grown == stable:
+            break
+        stable = grown
+    return stable
+
+
+class EndgameSolver:
+    '''
+    Exact alpha-beta (negamax) solver for the last empty squares, working on bitboards directly.
+    Scores are disc margins for the player to move at the end of the game, empty squares count
+    for nobody, as in minimax.eval_endgame.
+
+        Parameters:
+            deadline (float): time.perf_counter() value at which the solve is abandoned, None for no limit.
+            node_limit (int): positions visited before the solve is abandoned, None for no limit.
+    '''
+    def __init__(self, deadline=None, node_limit=None):
+        self.deadline = deadline
+        self.node_limit = node_limit
+        self.nodes = 0
+
+
+    def check_budget(self):
+        self.nodes += 1
+        if self.node_limit and self.nodes > self.node_limit:
+            raise SearchTimeout
+        if self.deadline and self.nodes & 1023 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout
+
+
+    def ordered_moves(self, player: int, opponent: int, moves: int, empty: int) -> list:
+        '''
+        Returns (square, flips) pairs, best candidates first. Far from the end, moves leaving the
+        opponent the fewest replies come first (fastest-first). Ties, and every move close to the end,
+        go to quadrants with an odd number of empty squares first, where the player can hope for the last move.
+        '''
+        odd = 0
+        for quadrant in QUADRANTS:
+            if (empty & quadrant).bit_count() & 1:
+                odd |= quadrant
+        candidates = []
+        fastest_first = empty.bit_count() > FASTEST_FIRST_EMPTIES
+        while moves:
+            low = moves & -moves
+            moves ^= low
+            square = low.bit_length() - 1
+            flips = flips_mask(square, player, opponent)
+            key = not low & odd
+            if fastest_first:
+                key = (legal_moves_mask(opponent & ~flips, player | flips | low).bit_count(), key)
+            candidates.append((key, square, flips))
+        candidates.sort()
+        return [(square, flips) for _, square, flips in candidates]
+
+
+    def last_move(self, player: int, opponent: int, empty: int) -> int:
+        '''Score with a single empty square left, played by whichever side can'''
+        square = empty.bit_length() - 1
+        flips = flips_mask(square, player, opponent)
+        if flips:
+            return player.bit_count() + 2*flips.bit_count() + 1 - opponent.bit_count()
+        flips = flips_mask(square, opponent, player)
+        if flips:
+            return player.bit_count() - 2*flips.bit_count() - 1 - opponent.bit_count()
+        return player.bit_count() - opponent.bit_count()
+
+
+    def solve(self, player: int, opponent: int, alpha: float=-64, beta: float=64) -> int:
+        '''
+        Returns the final margin of the player to move with perfect play, or a bound on it
+        when it falls outside (alpha, beta).
+        '''
+        self.check_budget()
+        empty = ~(player | opponent) & FULL
+        if empty & (empty - 1) == 0:
+            return self.last_move(player, opponent, empty) if empty else player.bit_count() - opponent.bit_count()
+
+        moves = legal_moves_mask(player, opponent)
+        if not moves:
+            if not legal_moves_mask(opponent, player):
+                return player.bit_count() - opponent.bit_count()
+            return -self.solve(opponent, player, -beta, -alpha)
+
+        if alpha >= STABILITY_ALPHA:
+            bound = 64 - 2*stable_discs(opponent).bit_count()
+            if bound <= alpha:
+                return bound
+
+        best = -65
+        for square, flips in self.ordered_moves(player, opponent, moves, empty):
+            score = -self.solve(opponent & ~flips, player | flips | (1 << square), -beta, -alpha)
+            if score > best:
+                best = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best
+
+
+    def wld(self, player: int, opponent: int) -> int:
+        '''Returns 1, 0 or -1 as the player to move wins, draws or loses, with a null-window search'''
+        score = self.solve(player, opponent, -1, 1)
+        return (score > 0) - (score < 0)
+
+
+    def principal_variation(self, player: int, opponent: int, score: int) -> list:
+        '''
+        Returns a line of squares (r*8 + c) reaching the exact score of the player to move,
+        passes are left out.
+        '''
+        line = []
+        while True:
+            moves = legal_moves_mask(player, opponent)
+            if not moves:
+                if not legal_moves_mask(opponent, player):
+                    return line
+                player, opponent, score = opponent, player, -score
+                continue
+            empty = ~(player | opponent) & FULL
+            for square, flips in self.ordered_moves(player, opponent, moves, empty):
+                child = (opponent & ~flips, player | flips | (1 << square))
+                if -self.solve(*child, -score - 1, -score + 1) == score:
+                    break
+            line.append(square)
+            (player, opponent), score = child, -score
@@ -1,24 +1,24 @@
-from othello.board import Board
-from copy import deepcopy
+from othello.board import Board, flips_mask, legal_moves_mask
+from othello.transposition import TranspositionTable, EXACT, LOWER, UPPER
+from othello.endgame import EndgameSolver, SearchTimeout
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing.util import Finalize
 import numpy as np
+import math, os, time
 
+# Shared by every search in the process, so positions met in earlier searches are not searched again
+TRANSPOSITION_TABLE = TranspositionTable(size=int(os.environ.get("OTHELLO_TT_SIZE", 2**18)),
+                                         replacement=os.environ.get("OTHELLO_TT_REPLACEMENT", "depth"),
+                                         fold_symmetry=os.environ.get("OTHELLO_TT_SYMMETRY", "0") == "1")
+# Processes searching root moves in parallel. Each process running searches gets a pool of its own,
+# so with several of them (e.g. the bot's WORKER_PROCESSES) use search_workers to stay within the cores.
+SEARCH_WORKERS = int(os.environ.get("OTHELLO_SEARCH_WORKERS", "1"))
+PARALLEL_MIN_DEPTH = 4 # Shallower iterations are too quick to be worth sending to other processes
+SOLVE_DEEPENING_SHARE = 0.1 # Share of a budget spent deepening before a solve, kept as a fallback if it does not finish
+SEARCH_POOLS = {} # workers -> ProcessPoolExecutor
 
-def eval_endgame(board: Board):
-    return board.black_disc_count - board.white_disc_count
-
-def eval_midgame(board: Board):
-    
-    # coin parity heuristic
-    coin_parity = (board.black_disc_count - board.white_disc_count) / (board.black_disc_count + board.white_disc_count)
-    
-    # mobility heuristic value
-    black_mobility = len(board.all_legal_moves(Board.BLACK))
-    white_mobility = len(board.all_legal_moves(Board.WHITE))
-    actual_mobility = (black_mobility - white_mobility) / (black_mobility + white_mobility)
 
-
-    # static weight heuristic value
-    static_weights = np.array([
+MIDGAME_WEIGHTS = np.array([
                     [5, -3, 2, 2, 2, 2, -3, 5],
                     [-3, -4, -1, -1, -1, -1, -4, -3],
                     [2, -1, 1, 0, 0, 1, -1, 2],
@@ -28,26 +28,7 @@ def eval_midgame(board: Board):
                     [-3, -4, -1, -1, -1, -1, -4, -3],
                     [5, -3, 2, 2, 2, 2, -3, 5]
                   ]).flatten()
-    black_weights = sum(value for value, coin in zip(static_weights, board.board.flatten()) if coin == Board.BLACK)
-    white_weights = sum(value for value, coin in zip(static_weights, board.board.flatten()) if coin == Board.WHITE)
-
-    if black_weights + white_weights == 0:
-        weight_value = 0
-    else:
-        weight_value = (black_weights - white_weights) / (black_weights + white_weights)
-
-    #return weight_value * 64
-    return (coin_parity + actual_mobility*2 + weight_value*2)/5 * 64
-
-def eval_earlygame(board:Board):
-    if board.black_disc_count == 0:
-        coin_parity == -1
-    elif board.white_disc_count == 0:
-        coin_parity == 1
-    else:
-        coin_parity = -(board.black_disc_count - board.white_disc_count) / (board.black_disc_count + board.white_disc_count)
-
-    static_weights = np.array([
+EARLYGAME_WEIGHTS = np.array([
                     [5, -4, 1, 1, 1, 1, -4, 5],
                     [-4, -4, 0, 0, 0, 0, -4, -4],
                     [1, 0, 0, 0, 0, 0, 0, 1],
@@ -57,98 +38,510 @@ def eval_earlygame(board:Board):
                     [-4, -4, 0, 0, 0, 0, -4, -4],
                     [5, -4, 1, 1, 1, 1, -4, 5]
                   ]).flatten()
-    black_weights = sum(value for value, coin in zip(static_weights, board.board.flatten()) if coin == Board.BLACK)
-    white_weights = sum(value for value, coin in zip(static_weights, board.board.flatten()) if coin == Board.WHITE)
 
+
+def weight_masks(weights) -> tuple:
+    '''Groups the squares of a weight table into one bitboard per non-zero weight'''
+    return tuple((int(weight), sum(1 << int(square) for square in np.flatnonzero(weights == weight)))
+                 for weight in np.unique(weights) if weight)
+
+MIDGAME_MASKS = weight_masks(MIDGAME_WEIGHTS)
+EARLYGAME_MASKS = weight_masks(EARLYGAME_WEIGHTS)
+
+
+def weighted_count(bits: int, masks: tuple) -> int:
+    '''Sum of the weights of the squares set in bits'''
+    return sum(weight * (bits & mask).bit_count() for weight, mask in masks)
+
+
+def midgame_value(black_count, white_count, black_mobility, white_mobility, black_weights, white_weights):
+    # coin parity heuristic
+    coin_parity = (black_count - white_count) / (black_count + white_count)
+    # mobility heuristic value
+    actual_mobility = (black_mobility - white_mobility) / (black_mobility + white_mobility)
+    # static weight heuristic value
     if black_weights + white_weights == 0:
         weight_value = 0
     else:
         weight_value = (black_weights - white_weights) / (black_weights + white_weights)
+    return (coin_parity + actual_mobility*2 + weight_value*2)/5 * 64
+
 
+def earlygame_value(black_count, white_count, black_weights, white_weights):
+    if black_count == 0:
+        coin_parity = -1
+    elif white_count == 0:
+        coin_parity = 1
+    else:
+        coin_parity = -(black_count - white_count) / (black_count + white_count)
+    if black_weights + white_weights == 0:
+        weight_value = 0
+    else:
+        weight_value = (black_weights - white_weights) / (black_weights + white_weights)
     return (coin_parity + weight_value*3) / 4 * 64
 
 
-def minimax(position: Board, depth: int, alpha: int, beta: int, eval_fun=eval_endgame) -> int:
-    if position.check_game_over():
-        return eval_endgame(position), []
-    elif depth == 0:
-        return eval_fun(position), []
-    best_line = []
-    # maximizing player's turn - Black
-    if position.turn == Board.BLACK:
-        maxEval = float('-inf')
-        legal_moves = position.all_legal_moves(Board.BLACK)
-        for row, col in legal_moves:
-            if position.board[row, col] == Board.EMPTY:
-                temp_position = deepcopy(position)
-                temp_position.push((row,col))
-
-                eval, line = minimax(temp_position, depth - 1, alpha, beta, eval_fun=eval_fun)
-                #maxEval = max(maxEval, eval)
-                if eval > maxEval:
-                    maxEval = eval
-                    best_line = [Board.coord2move((row,col))] + line
+def eval_endgame(board: Board):
+    return board.black_disc_count - board.white_disc_count
 
+def eval_midgame(board: Board):
+    black, white = board.bitboards()
+    return midgame_value(black.bit_count(), white.bit_count(),
+                         board.mobility(Board.BLACK), board.mobility(Board.WHITE),
+                         weighted_count(black, MIDGAME_MASKS), weighted_count(white, MIDGAME_MASKS))
+
+def eval_earlygame(board: Board):
+    black, white = board.bitboards()
+    return earlygame_value(black.bit_count(), white.bit_count(),
+                           weighted_count(black, EARLYGAME_MASKS), weighted_count(white, EARLYGAME_MASKS))
+
+
+def evaluate_children(position: Board, squares: list, eval_fun=eval_endgame) -> list:
+    '''
+    Scores the position after each of the given moves without playing them.
+    The static weights of all children are summed in one matrix product.
+    Children where the game is over are scored with eval_endgame, as in minimax.
+
+        Returns:
+            scores (list): one evaluation per move, from Black's point of view.
+    '''
+    player, opponent = position.bitboards()
+    if position.turn == Board.WHITE:
+        player, opponent = opponent, player
+    blacks, whites = [], []
+    for square in squares:
+        flips = flips_mask(square, player, opponent)
+        moved, flipped = player | flips | (1 << square), opponent & ~flips
+        if position.turn == Board.BLACK:
+            blacks.append(moved)
+            whites.append(flipped)
+        else:
+            blacks.append(flipped)
+            whites.append(moved)
+
+    black_counts = [black.bit_count() for black in blacks]
+    white_counts = [white.bit_count() for white in whites]
+    if eval_fun is eval_endgame:
+        return [b - w for b, w in zip(black_counts, white_counts)]
+    if eval_fun is eval_midgame:
+        weights = MIDGAME_WEIGHTS
+    elif eval_fun is eval_earlygame:
+        weights = EARLYGAME_WEIGHTS
+    else:
+        scores = []
+        for square in squares:
+            position.push(divmod(square, 8))
+            scores.append(eval_endgame(position) if position.check_game_over() else eval_fun(position))
+            position.pop()
+        return scores
+
+    bits = np.unpackbits(np.array(blacks + whites, dtype="<u8").view(np.uint8), bitorder="little")
+    totals = (bits.reshape(-1, 64) @ weights).tolist()
+    black_weights, white_weights = totals[:len(squares)], totals[len(squares):]
+    scores = []
+    for i, (black, white) in enumerate(zip(blacks, whites)):
+        black_mobility = legal_moves_mask(black, white).bit_count()
+        white_mobility = legal_moves_mask(white, black).bit_count()
+        if black_mobility == white_mobility == 0:
+            scores.append(black_counts[i] - white_counts[i])
+        elif weights is MIDGAME_WEIGHTS:
+            scores.append(midgame_value(black_counts[i], white_counts[i], black_mobility, white_mobility,
+                                        black_weights[i], white_weights[i]))
+        else:
+            scores.append(earlygame_value(black_counts[i], white_counts[i], black_weights[i], white_weights[i]))
+    return scores
+
+
+def square2move(square: int) -> str:
+    return Board.coord2move(divmod(square, 8))
+
+
+class Search:
+    '''
+    Alpha-beta search from Black's point of view, keeping the move ordering state
+    (killer moves and history scores) across the iterations of iterative deepening.
+
+        Parameters:
+            eval_fun (function): evaluation of positions at the depth limit.
+            tt (TranspositionTable): results shared between searches, or None.
+            time_limit (float): seconds before the search is abandoned, None for no limit.
+            node_limit (int): positions visited before the search is abandoned, None for no limit.
+    '''
+    def __init__(self, eval_fun=eval_endgame, tt: TranspositionTable=None, time_limit=None, node_limit=None):
+        self.eval_fun = eval_fun
+        self.tt = tt
+        self.time_limit = time_limit
+        self.deadline = time.perf_counter() + time_limit if time_limit else None
+        self.node_limit = node_limit
+        self.solver = EndgameSolver(self.deadline) if eval_fun is eval_endgame else None
+        self.budgeted = True
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(64)] # two moves per ply that caused a cutoff
+        self.history = {Board.BLACK: [0]*64, Board.WHITE: [0]*64} # cutoff counts weighted by depth, per square
+
+
+    def check_budget(self):
+        self.nodes += 1
+        if not self.budgeted:
+            return
+        if self.node_limit and self.nodes > self.node_limit:
+            raise SearchTimeout
+        if self.deadline and self.nodes & 255 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout
+
+
+    def budget_used(self) -> float:
+        '''Share of the time or node budget spent so far, whichever is larger'''
+        used = 0
+        if self.deadline:
+            used = 1 - (self.deadline - time.perf_counter()) / self.time_limit
+        if self.node_limit:
+            used = max(used, self.nodes / self.node_limit)
+        return used
+
+
+    def order_moves(self, position: Board, depth: int, ply: int, first: int=None) -> list:
+        '''
+        Returns the legal squares, best candidates first: the principal variation or hash move,
+        then killer moves, then the moves leaving the opponent the fewest replies, then history.
+        Mobility is only measured far enough from the leaves to pay for itself.
+        '''
+        turn = position.turn
+        squares = [row*8 + col for row, col in position.all_legal_moves(turn)]
+        if len(squares) < 2:
+            return squares
+        killers, history = self.killers[ply], self.history[turn]
+        if depth > 2:
+            mobility = {}
+            for square in squares:
+                position.push(divmod(square, 8))
+                mobility[square] = position.mobility(-turn)
+                position.pop()
+            key = lambda square: (square == first, square in killers, -mobility[square], history[square])
+        else:
+            key = lambda square: (square == first, square in killers, history[square])
+        return sorted(squares, key=key, reverse=True)
+
+
+    def record_cutoff(self, turn: int, square: int, depth: int, ply: int):
+        killers = self.killers[ply]
+        if killers[0] != square:
+            killers[1], killers[0] = killers[0], square
+        self.history[turn][square] += depth * depth
+
+
+    def solve(self, black: int, white: int, turn: int, alpha: float, beta: float) -> int:
+        '''
+        Solves a position to the end with the endgame solver, from Black's point of view.
+        Used instead of the search when the depth left reaches every empty square.
+        '''
+        solver = self.solver
+        solver.nodes = 0
+        solver.node_limit = self.node_limit and self.node_limit - self.nodes
+        try:
+            if turn == Board.BLACK:
+                return solver.solve(black, white, alpha, beta)
+            return -solver.solve(white, black, -beta, -alpha)
+        finally:
+            self.nodes += solver.nodes
+
+
+    def search(self, position: Board, depth: int, alpha: float, beta: float, ply: int=0, pv: list=()) -> tuple:
+        '''
+        Returns the evaluation and the best line as squares (r*8 + c).
+        pv is the best line found for this position by the previous iteration, searched first.
+        The board is restored when the budget runs out mid-search.
+        '''
+        self.check_budget()
+        if position.check_game_over():
+            return eval_endgame(position), []
+        elif depth == 0:
+            return self.eval_fun(position), []
+        if self.solver:
+            black, white = position.bitboards()
+            if depth >= 64 - (black | white).bit_count():
+                return self.solve(black, white, position.turn, alpha, beta), []
+
+        first = pv[0] if pv else None
+        tt = self.tt
+        if tt is not None:
+            key, symmetry = tt.key(position)
+            entry = tt.get(key, symmetry, self.eval_fun.__name__)
+            if entry:
+                entry_depth, flag, value, line = entry
+                if entry_depth >= depth and (flag == EXACT or (flag == LOWER and value >= beta) or (flag == UPPER and value <= alpha)):
+                    return value, line
+                if first is None and line:
+                    first = line[0]
+            alpha_orig, beta_orig = alpha, beta
+
+        # Black maximizes, White minimizes
+        maximizing = position.turn == Board.BLACK
+        bestEval = float('-inf') if maximizing else float('+inf')
+        best_line = []
+        squares = self.order_moves(position, depth, ply, first)
+        if depth == 1:
+            # Leaves are scored together instead of one push, check and pop each
+            self.nodes += len(squares)
+            for square, eval in zip(squares, evaluate_children(position, squares, self.eval_fun)):
+                if eval > bestEval if maximizing else eval < bestEval:
+                    bestEval = eval
+                    best_line = [square]
+            if bestEval >= beta if maximizing else bestEval <= alpha:
+                self.record_cutoff(position.turn, best_line[0], depth, ply)
+            squares = []
+        for square in squares:
+            position.push(divmod(square, 8))
+            try:
+                eval, line = self.search(position, depth - 1, alpha, beta, ply + 1, pv[1:] if pv and square == first else ())
+            finally:
+                position.pop()
+            if maximizing:
+                if eval > bestEval:
+                    bestEval = eval
+                    best_line = [square] + line
                 alpha = max(alpha, eval)
-                if beta <= alpha:
-                    break
-
-        return maxEval, best_line
-
-    # else minimizing player's turn - White
-    minEval = float('+inf')
-    legal_moves = position.all_legal_moves(Board.WHITE)
-    for row, col in legal_moves:
-        if position.board[row, col] == Board.EMPTY:
-            temp_position = deepcopy(position)
-            temp_position.push((row,col))
-
-            eval, line = minimax(temp_position, depth - 1, alpha, beta, eval_fun=eval_fun)
-            #minEval = min(minEval, eval)
-            if eval < minEval:
-                minEval = eval
-                best_line = [Board.coord2move((row,col))] + line
-
-            beta = min(beta, eval)
+            else:
+                if eval < bestEval:
+                    bestEval = eval
+                    best_line = [square] + line
+                beta = min(beta, eval)
             if beta <= alpha:
+                self.record_cutoff(position.turn, square, depth, ply)
                 break
 
-    return minEval, best_line
-
-
-def find_best_moves(position: Board, n=4) -> list:
-    moves = []
-
-    legal_moves = position.all_legal_moves(position.turn)
+        if tt is not None:
+            if bestEval <= alpha_orig:
+                flag = UPPER
+            elif bestEval >= beta_orig:
+                flag = LOWER
+            else:
+                flag = EXACT
+            tt.put(key, depth, flag, bestEval, best_line, symmetry, self.eval_fun.__name__)
+        return bestEval, best_line
+
+
+def minimax(position: Board, depth: int, alpha: int, beta: int, eval_fun=eval_endgame, tt: TranspositionTable=None) -> tuple:
+    return Search(eval_fun, tt).search(position, depth, alpha, beta)
+
+
+def search_workers(processes: int=1, workers: int=SEARCH_WORKERS) -> int:
+    '''
+    Returns the search pool size for each of processes processes searching at the same time,
+    at most workers and small enough that all their pools together do not exceed the host cores.
+    '''
+    return max(1, min(workers, (os.cpu_count() or 1) // processes))
+
+
+def search_pool(workers: int) -> ProcessPoolExecutor:
+    '''Returns the process pool used for parallel root search, created on first use'''
+    if workers not in SEARCH_POOLS:
+        if not SEARCH_POOLS:
+            # Also runs when a worker process of another pool exits, which otherwise waits forever for
+            # the search processes. It must run before the finalizers (priority 10) closing the pool's queues.
+            Finalize(None, shutdown_search_pools, exitpriority=100)
+        SEARCH_POOLS[workers] = ProcessPoolExecutor(max_workers=workers)
+    return SEARCH_POOLS[workers]
+
+
+def shutdown_search_pools():
+    '''Stops the search pools of this process and waits for their processes to exit'''
+    while SEARCH_POOLS:
+        _, pool = SEARCH_POOLS.popitem()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def search_root_move(board_state: str, square: int, eval_fun, depth: int, alpha: float, beta: float,
+                     pv: list, time_limit=None, node_limit=None) -> tuple:
+    '''
+    Searches the position after one root move inside a search pool worker.
+    Each worker keeps its own transposition table between jobs.
+
+        Returns:
+            eval (float): evaluation from Black's point of view, a bound if outside (alpha, beta).
+            line (list): best line as squares.
+            nodes (int): positions visited.
+    '''
+    position = Board(board_state)
+    position.push(divmod(square, 8))
+    search = Search(eval_fun, TRANSPOSITION_TABLE, time_limit=time_limit, node_limit=node_limit)
+    eval, line = search.search(position, depth, alpha, beta, 1, pv)
+    return eval, line, search.nodes
+
+
+def parallel_iteration(position: Board, order: list, n: int, depth: int, search: Search, pvs: dict, workers: int,
+                       window: tuple=(-math.inf, math.inf)) -> dict:
+    '''
+    Searches the root moves of one iteration across the search pool.
+    The first n moves of the order are searched with a full window. The remaining moves only
+    need to prove they score below the n-th best exact score so far, which is raised as results come in.
+    Moves scoring strictly below it cannot be among the n best, so the best moves and their
+    evaluations are the same as with a serial search. Evaluations are clamped to the root window.
+
+        Returns:
+            iteration (dict): square -> (eval, line), exact for the moves that can be among the n best.
+    '''
+    turn = position.turn
+    board_state = position.get_board_state()
+    pool = search_pool(workers)
+    iteration, exact = {}, [] # exact holds root scores, from the point of view of the player to move
+    eldest = min(n, len(order))
+
+    def submit(square):
+        threshold = sorted(exact, reverse=True)[n - 1] if len(exact) >= n else -math.inf
+        lower = math.nextafter(threshold, -math.inf)
+        alpha, beta = window
+        if turn == Board.BLACK:
+            alpha = max(alpha, lower)
+        else:
+            beta = min(beta, -lower)
+        time_limit = node_limit = None
+        if search.deadline:
+            time_limit = search.deadline - time.perf_counter()
+            if time_limit <= 0:
+                raise SearchTimeout
+        if search.node_limit:
+            node_limit = search.node_limit - search.nodes
+        future = pool.submit(search_root_move, board_state, square, search.eval_fun, depth, alpha, beta,
+                             pvs.get(square, (0, []))[1], time_limit, node_limit)
+        return future, (square, lower)
+
+    running = {}
+    i = 0
+    try:
+        while i < len(order) or running:
+            # Young brothers wait for their elders, whose scores give them a bound
+            while i < len(order) and len(running) < workers and (i < eldest or len(iteration) >= eldest):
+                future, job = submit(order[i])
+                running[future] = job
+                i += 1
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                square, lower = running.pop(future)
+                eval, line, nodes = future.result()
+                eval = min(max(eval, window[0]), window[1])
+                search.nodes += nodes
+                iteration[square] = (eval, line)
+                if eval*turn > lower:
+                    exact.append(eval*turn)
+    except SearchTimeout:
+        for future in running:
+            future.cancel()
+        raise
+    if search.node_limit and search.nodes > search.node_limit:
+        raise SearchTimeout
+    return iteration
+
+
+def iteration_depths(search: Search, max_depth: int, solving: bool):
+    '''
+    Yields the depths of iterative deepening. When the last iteration solves the endgame, it is reached
+    directly if there is no budget. Otherwise the deepening goes on while it uses a small share of the budget,
+    so that a solve cut short falls back on a search deeper than the static evaluation.
+    '''
+    if not solving:
+        yield from range(max_depth + 1)
+        return
+    yield 0
+    if search.deadline or search.node_limit:
+        depth = 1
+        while depth < max_depth and search.budget_used() < SOLVE_DEEPENING_SHARE:
+            yield depth
+            depth += 1
+    if max_depth:
+        yield max_depth
+
+
+def find_best_moves(position: Board, n=4, tt: TranspositionTable=TRANSPOSITION_TABLE, time_limit=None, node_limit=None,
+                    workers=SEARCH_WORKERS, exact=True) -> list:
+    '''
+    Evaluates every legal move with iterative deepening and returns the n best.
+    Each iteration searches the root moves in the order of the previous one and starts from their principal variations.
+    When the time or node budget runs out, the results of the deepest completed iteration are returned.
+    Endgame positions are solved with the endgame solver as the last iteration, see iteration_depths.
+
+        Parameters:
+            position (Board): position to search, left unchanged.
+            n (int): number of moves returned.
+            tt (TranspositionTable): results shared between searches, or None.
+            time_limit (float): seconds to search for, None for no limit.
+            node_limit (int): positions to search, None for no limit.
+            workers (int): processes searching root moves in parallel, 1 to search in this process.
+            exact (bool): in solved endgames, whether to find the exact disc margins. Otherwise moves are
+                          only told apart as winning, drawing or losing (eval 1, 0 or -1), which is much
+                          faster, and lines only hold the move itself. If the budget runs out before the
+                          solve completes, the evaluations of the deepest completed iteration are returned.
+
+        Returns:
+            moves (list): dicts with the coord, move, eval and line of the best moves, best first.
+    '''
+    legal_moves = [row*8 + col for row, col in position.all_legal_moves(position.turn)]
+    if not legal_moves:
+        return []
 
     if position.move >= 48:
-        eval_function, depth = eval_endgame, 20
+        eval_function, max_depth = eval_endgame, 20
     elif position.move > 20:
-        eval_function, depth = eval_midgame, 1
+        eval_function, max_depth = eval_midgame, 1
     else:
-        eval_function, depth = eval_midgame, 0
-    
-    for row, col in legal_moves:
-        if position.board[row, col] == Board.EMPTY:
-            temp_position = deepcopy(position)
-            temp_position.push((row,col))
-
-            currentEval, line = minimax(temp_position, depth, float('-inf'), float('inf'), eval_function)
-            moves.append({"coord":(row,col), 
-                          "move": Board.coord2move((row,col)),
-                           "eval":currentEval*position.turn, 
-                           "line": [Board.coord2move((row,col))] + line
-                           })
-        
-        moves.sort(key=lambda x: x["eval"], reverse=True)
-        moves = moves[:min(len(moves), n)]
-    return moves
-
-
-
-
-
-
-
-
-
+        eval_function, max_depth = eval_midgame, 0
+    # Searching deeper than the number of empty squares left cannot change the result
+    empties = 64 - position.black_disc_count - position.white_disc_count
+    max_depth = min(max_depth, empties - 1)
+    # The endgame solver takes over once the depth reaches the end of the game
+    solving = eval_function is eval_endgame and max_depth == empties - 1
+    wld = solving and not exact
+
+    if tt is not None:
+        tt.new_search()
+    search = Search(eval_function, tt, time_limit=time_limit, node_limit=node_limit)
+    turn = position.turn
+    results = {} # square -> (eval, line) of the deepest completed iteration
+    solved = False
+    order = legal_moves
+    for depth in iteration_depths(search, max_depth, solving):
+        search.budgeted = depth > 0 # the static first pass always completes
+        # Black's win/draw/loss is enough for the solve, unsolved iterations keep their evaluations
+        window = (-1, 1) if wld and depth == max_depth else (-math.inf, math.inf)
+        iteration = {}
+        try:
+            if workers > 1 and depth >= PARALLEL_MIN_DEPTH and len(order) > 1:
+                iteration = parallel_iteration(position, order, n, depth, search, results, workers, window)
+            else:
+                for square in order:
+                    position.push(divmod(square, 8))
+                    try:
+                        eval, line = search.search(position, depth, *window, 1, results.get(square, (0, []))[1])
+                        iteration[square] = (min(max(eval, window[0]), window[1]), line)
+                    finally:
+                        position.pop()
+        except SearchTimeout:
+            break
+        results = iteration
+        solved = solving and depth == max_depth
+        order = sorted(order, key=lambda square: results[square][0]*turn, reverse=True)
+
+    best = sorted(legal_moves, key=lambda square: results[square][0]*turn, reverse=True)[:n]
+    if solved and exact:
+        # The solver only returns scores, the lines are rebuilt from them with what is left of the budget
+        nodes_left = search.node_limit and max(search.node_limit - search.nodes, 1) # 0 would mean no limit
+        solver = EndgameSolver(search.deadline, nodes_left)
+        try:
+            for square in best:
+                position.push(divmod(square, 8))
+                try:
+                    black, white = position.bitboards()
+                    if position.turn == Board.BLACK:
+                        line = solver.principal_variation(black, white, results[square][0])
+                    else:
+                        line = solver.principal_variation(white, black, -results[square][0])
+                finally:
+                    position.pop()
+                results[square] = (results[square][0], line)
+        except SearchTimeout:
+            pass # the remaining lines only hold their first move
+    return [{"coord": divmod(square, 8),
+             "move": square2move(square),
+             "eval": results[square][0]*turn,
+             "line": [square2move(square)] + [square2move(s) for s in results[square][1]]
+             } for square in best]
@@ -1,7 +1,25 @@
-import pandas as pd
+"""
+Builds Othello puzzles or vote positions from a CSV of recorded games (a "game_moves" column of concatenated moves, e.g. "f5d6c3").
+
+    python -m othello.puzzle_generator puzzle games.csv data/othello_puzzles.csv [-n 100] [--workers N]
+    python -m othello.puzzle_generator votechess games.csv data/othello_votechess.csv [-n 500] [--workers N]
+
+Games are streamed from the source, and the positions to analyse are searched across a process pool.
+Results are appended to the output as they are found. A checkpoint next to the output
+records how far the run got, so running the same command again resumes it.
+"""
 from othello.board import Board
 import othello.minimax as minimax
+from othello.transposition import canonical_hash
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
 from tqdm import tqdm
+import argparse, csv, json, logging, os, time
+
+PUZZLE_COLUMNS = ["board_state", "solution_line", "move_choices", "evaluations"]
+VOTECHESS_COLUMNS = ["board_state"]
+
 
 def get_sign(evaluation):
     if evaluation > 0:
@@ -12,72 +30,204 @@ def get_sign(evaluation):
         return 0
 
 
-def generate_puzzles(src_csv, dest_csv, n=100):
-    df = pd.read_csv(src_csv)
-    puzzle_count = 0
+def stream_games(src_csv):
+    with open(src_csv, newline="") as f:
+        for row in csv.DictReader(f):
+            yield row["game_moves"]
 
-    puzzle_df = pd.DataFrame(columns=["board_state", "solution_line", "move_choices", "evaluations"])
-    with tqdm(total=n) as pbar:
-        for game_moves in df["game_moves"]:
-            b = Board()
-            if n and puzzle_count >= n:
-                break
-            while len(game_moves)>=2:
-                move = game_moves[:2]
-                game_moves = game_moves[2:]
-                b.push(move)
-                legal_moves = b.all_legal_moves()
-                if b.move < 50:
-                    continue
-                elif b.move>56:
-                    break
-                elif len(legal_moves)<=2 or len(legal_moves)>=5:
-                    continue
-                
-                moves = minimax.find_best_moves(b, n=4)
-                move1 = moves[0]["eval"]
-                move2 = moves[1]["eval"]
-                if get_sign(move1) == get_sign(move2):
-                    continue
-                elif abs(move1) > 4:
-                    continue
-
-                move_choices = " ".join([move["move"] for move in moves])
-                evaluations = " ".join([str(int(move["eval"])) for move in moves])
-                solution_line = " ".join(moves[0]["line"])
-                row = {"board_state": b.get_board_state(), "solution_line": solution_line,
-                       "move_choices": move_choices, "evaluations": evaluations}
-                puzzle_df.loc[len(puzzle_df)] = row
-                puzzle_count+=1
-                pbar.update(1)
-                puzzle_df.to_csv(dest_csv,index=False)
+
+def game_candidates(game_moves, first_move, last_move, seen):
+    """
+    Replays a game and returns the board states between first_move and last_move with 3 or 4 legal moves.
+    Positions in seen, mirrored ones included, are skipped, and the new ones are added to it,
+    so every position in seen is analysed by exactly one game.
+    """
+    candidates = []
+    b = Board()
+    while len(game_moves)>=2:
+        move = game_moves[:2]
+        game_moves = game_moves[2:]
+        b.push(move)
+        if b.move < first_move:
+            continue
+        elif b.move > last_move:
+            break
+        elif not 3 <= len(b.all_legal_moves()) <= 4:
+            continue
+        key = canonical_hash(*b.bitboards(), b.turn == Board.WHITE)
+        if key in seen:
+            continue
+        seen.add(key)
+        candidates.append(b.get_board_state())
+    return candidates
+
+
+def analyse_puzzle(board_states):
+    """
+    Returns a row for every position with a single good move: the two best moves must have
+    different outcomes and the best one must not win by more than 4 discs.
+    """
+    rows = []
+    for board_state in board_states:
+        # Positions are already searched in parallel, and pool workers cannot start processes of their own
+        moves = minimax.find_best_moves(Board(board_state), n=4, workers=1)
+        move1 = moves[0]["eval"]
+        move2 = moves[1]["eval"]
+        if get_sign(move1) == get_sign(move2):
+            continue
+        elif abs(move1) > 4:
+            continue
+
+        move_choices = " ".join([move["move"] for move in moves])
+        evaluations = " ".join([str(int(move["eval"])) for move in moves])
+        solution_line = " ".join(moves[0]["line"])
+        rows.append({"board_state": board_state, "solution_line": solution_line,
+                     "move_choices": move_choices, "evaluations": evaluations})
+    return rows
+
+
+def analyse_votechess(board_states):
+    """
+    Returns a row for every position that the player to move wins.
+    """
+    rows = []
+    for board_state in board_states:
+        best_move = minimax.find_best_moves(Board(board_state), 1, workers=1, exact=False)[0]
+        if best_move["eval"] > 0:
+            rows.append({"board_state": board_state})
+    return rows
+
+
+# kind -> (first move, last move, analysis, output columns)
+KINDS = {
+    "puzzle": (50, 56, analyse_puzzle, PUZZLE_COLUMNS),
+    "votechess": (48, 54, analyse_votechess, VOTECHESS_COLUMNS),
+}
+
+
+def analyse_games(kind, games):
+    """
+    Analyses a chunk of (game index, board states) pairs in a worker.
+
+        Returns:
+            results (list): (game index, result rows) pairs.
+    """
+    analyse = KINDS[kind][2]
+    return [(index, analyse(board_states)) for index, board_states in games]
+
+
+def analyse_in_pool(pool, kind, games, chunk_size, max_pending):
+    """
+    Sends chunks of games to the pool and yields their results in order.
+    At most max_pending chunks are in flight, so the source is read only as fast as it is analysed.
+    """
+    pending = deque()
+    while True:
+        chunk = list(islice(games, chunk_size))
+        if chunk:
+            pending.append(pool.apply_async(analyse_games, (kind, chunk)))
+        if pending and (not chunk or len(pending) >= max_pending):
+            yield from pending.popleft().get()
+        elif not chunk:
+            return
+
+
+def read_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as f:
+        return json.load(f)
+
+
+def write_checkpoint(checkpoint_path, checkpoint):
+    with open(checkpoint_path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+
+def generate(kind, src_csv, dest_csv, n=None, workers=None, chunk_size=4):
+    """
+    Streams the games of src_csv and appends every qualifying position to dest_csv until n results are found.
+
+        Parameters:
+            kind (str): "puzzle" or "votechess", see KINDS.
+            src_csv (str): path to the source games.
+            dest_csv (str): output path, resumed from its checkpoint if one exists.
+            n (int): number of results wanted in the output, None for all games.
+            workers (int): analysis processes, defaults to the number of cores.
+            chunk_size (int): games sent to a worker at a time.
+
+        Returns:
+            count (int): number of results in the output.
+    """
+    first_move, last_move, _, columns = KINDS[kind]
+    checkpoint_path = dest_csv + ".checkpoint"
+    checkpoint = read_checkpoint(checkpoint_path) if os.path.exists(dest_csv) else None
+    if checkpoint:
+        # Rows written after the last checkpoint are dropped and found again
+        with open(dest_csv, "r+") as f:
+            f.truncate(checkpoint["offset"])
+        logging.info(f"Resuming after game {checkpoint['games']} with {checkpoint['count']} results.")
+    else:
+        with open(dest_csv, "w", newline="") as f:
+            csv.writer(f, lineterminator="\n").writerow(columns)
+            checkpoint = {"games": 0, "count": 0, "offset": f.tell()}
+        write_checkpoint(checkpoint_path, checkpoint)
+    if n and checkpoint["count"] >= n:
+        return checkpoint["count"]
+
+    seen = set()
+    def games():
+        for index, game_moves in enumerate(stream_games(src_csv)):
+            # Games done before a resume are replayed too, so that their positions are not analysed again
+            board_states = game_candidates(game_moves, first_move, last_move, seen)
+            if board_states and index >= checkpoint["games"]:
+                yield index, board_states
+
+    start, found = time.perf_counter(), 0
+    workers = workers or os.cpu_count() or 1
+    with Pool(workers) as pool, open(dest_csv, "a", newline="") as f, \
+            tqdm(total=n, initial=checkpoint["count"], unit=kind) as progress:
+        writer = csv.DictWriter(f, fieldnames=columns, lineterminator="\n")
+        for index, rows in analyse_in_pool(pool, kind, games(), chunk_size, 2*workers):
+            checkpoint["games"] = index + 1
+            if not rows:
+                continue
+            # Rows past n are dropped with the rest of the game
+            rows = rows[:n - checkpoint["count"]] if n else rows
+            writer.writerows(rows)
+            f.flush()
+            found += len(rows)
+            checkpoint["count"] += len(rows)
+            checkpoint["offset"] = f.tell()
+            write_checkpoint(checkpoint_path, checkpoint)
+            progress.update(len(rows))
+            if n and checkpoint["count"] >= n:
                 break
-                    
-        #puzzle_df.to_csv(dest_csv,index=False)
+        f.flush()
+        checkpoint["offset"] = f.tell()
+        write_checkpoint(checkpoint_path, checkpoint)
 
+    elapsed = time.perf_counter() - start
+    logging.info(f"Found {found} in {elapsed:.1f}s ({found / elapsed:.2f} {kind}/s), {checkpoint['count']} in total.")
+    return checkpoint["count"]
 
 
-def generate_votechess_positions(src_csv, dest_csv, n=500):
-    df = pd.read_csv(src_csv)
-    df = df.sample(n)
-    vc_df = pd.DataFrame(columns=["board_state"])
-    for index in tqdm(df.index):
-        
-        game_moves = df["game_moves"][index]
+def generate_puzzles(src_csv, dest_csv, n=100, workers=None):
+    return generate("puzzle", src_csv, dest_csv, n=n, workers=workers)
 
-        b = Board()
-        while len(game_moves)>=2:
-            move = game_moves[:2]
-            game_moves = game_moves[2:]
-            b.push(move)
-            if (b.move >= 48) and (b.move <= 54) and len(b.all_legal_moves())>=3 and len(b.all_legal_moves())<=4:
-                best_move = minimax.find_best_moves(b,1)[0]
-                if best_move["eval"] > 0:
-                    row = {"board_state": b.get_board_state()}
-                    vc_df.loc[len(vc_df)] = row
-                    break
-        
-    vc_df.to_csv(dest_csv, index=False)
 
+def generate_votechess_positions(src_csv, dest_csv, n=500, workers=None):
+    return generate("votechess", src_csv, dest_csv, n=n, workers=workers)
 
 
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Generate Othello puzzles or vote positions from recorded games.")
+    parser.add_argument("kind", choices=sorted(KINDS))
+    parser.add_argument("src", help="CSV of games with a game_moves column")
+    parser.add_argument("dest", help="output CSV, resumed if a checkpoint exists")
+    parser.add_argument("-n", type=int, default=None, help="results wanted, defaults to all games")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of cores")
+    args = parser.parse_args()
+    generate(args.kind, args.src, args.dest, n=args.n, workers=args.workers)
@@ -0,0 +1,113 @@
+from PIL import Image, ImageDraw, ImageFont
+import io
+
+BOARD_PATH = "./othello/othello_board.png"
+FONT_PATH = "./othello/ARIAL.TTF"
+BORDER_SIZE = 34
+TILE_SIZE = 75
+TILE_BUFFER = 3
+
+
+class BoardRenderer:
+    """
+    Draws Othello boards by pasting pre-drawn disc sprites onto the board background,
+    both loaded once, instead of opening the background and drawing every disc for each image.
+    """
+    def __init__(self, board_path=BOARD_PATH, font_path=FONT_PATH):
+        self.background = Image.open(board_path).convert("RGB")
+        self.font = ImageFont.truetype(font_path, size=40)
+        disc_size = TILE_SIZE - 2*TILE_BUFFER + 1
+        self.discs = {}
+        for colour in ("black", "white"):
+            sprite = Image.new("RGBA", (disc_size, disc_size), (0, 0, 0, 0))
+            ImageDraw.Draw(sprite).ellipse((0, 0, disc_size - 1, disc_size - 1), fill=colour, outline="black")
+            self.discs[colour] = sprite
+
+
+    @staticmethod
+    def square_origin(square):
+        r, c = divmod(square, 8)
+        return BORDER_SIZE + c*TILE_SIZE + TILE_BUFFER, BORDER_SIZE + r*TILE_SIZE + TILE_BUFFER
+
+
+    def draw_square(self, canvas, square, colour=None):
+        """
+        Paints one square of canvas, with a disc of the given colour or empty.
+        """
+        x, y = self.square_origin(square)
+        sprite = self.discs["black"]
+        canvas.paste(self.background.crop((x, y, x + sprite.width, y + sprite.height)), (x, y))
+        if colour:
+            sprite = self.discs[colour]
+            canvas.paste(sprite, (x, y), sprite)
+
+
+    def render(self, black, white, moves=None):
+        """
+        Renders a position given as black and white bitboards (square r*8 + c is bit r*8 + c).
+        moves are minimax.find_best_moves results whose evaluations are written on their squares.
+        """
+        canvas = self.background.copy()
+        for colour, bits in (("black", black), ("white", white)):
+            while bits:
+                low = bits & -bits
+                bits ^= low
+                x, y = self.square_origin(low.bit_length() - 1)
+                canvas.paste(self.discs[colour], (x, y), self.discs[colour])
+        if moves:
+            draw = ImageDraw.Draw(canvas)
+            for move in moves:
+                r, c = move["coord"]
+                draw.text(self.square_origin(r*8 + c), str(int(move["eval"])), fill="orange", font=self.font)
+        return canvas
+
+
+    def render_png(self, black, white, moves=None):
+        """
+            Returns:
+                im_bytes (bytes): png encoded image.
+                im (PIL.Image): the image.
+        """
+        im = self.render(black, white, moves)
+        buffer = io.BytesIO()
+        im.save(buffer, format="PNG")
+        return buffer.getvalue(), im
+
+
+    def render_line(self, board, moves):
+        """
+        Renders one frame per move played from board, redrawing only the squares that changed.
+
+            Parameters:
+                board (Board): starting position, moves are pushed onto it.
+                moves (list): moves to play.
+
+            Returns:
+                frames (list): PIL images, one per move.
+        """
+        black, white = board.bitboards()
+        canvas = self.render(black, white)
+        frames = []
+        for move in moves:
+            board.push(move)
+            new_black, new_white = board.bitboards()
+            changed = (black ^ new_black) | (white ^ new_white)
+            while changed:
+                low = changed & -changed
+                changed ^= low
+                colour = "black" if new_black & low else "white" if new_white & low else None
+                self.draw_square(canvas, low.bit_length() - 1, colour)
+            black, white = new_black, new_white
+            frames.append(canvas.copy())
+        return frames
+
+
+_renderer = None
+
+
+def get_renderer():
+    """Returns the renderer of this process, created on first use"""
+    global _renderer
+    if _renderer is None:
+        _renderer = BoardRenderer()
+    return _renderer
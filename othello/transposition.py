@@ -0,0 +1,180 @@
+import random
+
+FULL = 0xFFFFFFFFFFFFFFFF
+
+# Zobrist keys, one per (colour, square) plus one for white to move. The seed is fixed so
+# that hashes are the same in every process and run.
+_rng = random.Random(0x0781E110)
+BLACK_KEYS = [_rng.getrandbits(64) for _ in range(64)]
+WHITE_KEYS = [_rng.getrandbits(64) for _ in range(64)]
+WHITE_TO_MOVE = _rng.getrandbits(64)
+
+
+def _byte_tables(keys):
+    # tables[i][byte] is the XOR of the keys of the squares set in byte i of a bitboard
+    tables = []
+    for i in range(8):
+        table = [0] * 256
+        for byte in range(1, 256):
+            low = byte & -byte
+            table[byte] = table[byte ^ low] ^ keys[i*8 + low.bit_length() - 1]
+        tables.append(table)
+    return tables
+
+BLACK_TABLES = _byte_tables(BLACK_KEYS)
+WHITE_TABLES = _byte_tables(WHITE_KEYS)
+FLIP_TABLES = [[b ^ w for b, w in zip(black, white)] for black, white in zip(BLACK_TABLES, WHITE_TABLES)]
+
+
+def zobrist_bits(bits, tables):
+    '''XOR of the keys of every square set in bits'''
+    h = 0
+    for i, byte in enumerate(bits.to_bytes(8, "little")):
+        if byte:
+            h ^= tables[i][byte]
+    return h
+
+
+def zobrist_hash(black, white, white_to_move):
+    h = zobrist_bits(black, BLACK_TABLES) ^ zobrist_bits(white, WHITE_TABLES)
+    return h ^ WHITE_TO_MOVE if white_to_move else h
+
+
+# --------------------------- Symmetries --------------------------- #
+
+REVERSED_BYTES = bytes(int(f"{byte:08b}"[::-1], 2) for byte in range(256))
+
+
+def flip_vertical(bits):
+    '''Row r goes to row 7 - r'''
+    return int.from_bytes(bits.to_bytes(8, "little"), "big")
+
+
+def mirror_horizontal(bits):
+    '''Column c goes to column 7 - c'''
+    return int.from_bytes(bits.to_bytes(8, "little").translate(REVERSED_BYTES), "little")
+
+
+def transpose(bits):
+    '''Square (r, c) goes to (c, r)'''
+    t = 0x0F0F0F0F00000000 & (bits ^ (bits << 28))
+    bits ^= t ^ (t >> 28)
+    t = 0x3333000033330000 & (bits ^ (bits << 14))
+    bits ^= t ^ (t >> 14)
+    t = 0x5500550055005500 & (bits ^ (bits << 7))
+    bits ^= t ^ (t >> 7)
+    return bits & FULL
+
+
+def _symmetry(k):
+    def apply(bits):
+        if k & 1:
+            bits = transpose(bits)
+        if k & 2:
+            bits = flip_vertical(bits)
+        if k & 4:
+            bits = mirror_horizontal(bits)
+        return bits
+    return apply
+
+SYMMETRIES = [_symmetry(k) for k in range(8)]
+# SQUARE_MAPS[k][square] is where symmetry k sends square, INVERSE_MAPS undoes it
+SQUARE_MAPS = [[(sym(1 << square)).bit_length() - 1 for square in range(64)] for sym in SYMMETRIES]
+INVERSE_MAPS = [[square_map.index(square) for square in range(64)] for square_map in SQUARE_MAPS]
+
+
+def canonical(black, white):
+    '''
+    Returns the smallest (black, white) pair among the 8 symmetries of the position
+    and the index of the symmetry producing it.
+    '''
+    best, best_k = (black, white), 0
+    for k in range(1, 8):
+        sym = SYMMETRIES[k]
+        pair = (sym(black), sym(white))
+        if pair < best:
+            best, best_k = pair, k
+    return best, best_k
+
+
+def canonical_hash(black, white, white_to_move):
+    '''Zobrist hash shared by a position and its 7 mirror images'''
+    (black, white), _ = canonical(black, white)
+    return zobrist_hash(black, white, white_to_move)
+
+
+# --------------------------- Transposition table --------------------------- #
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class TranspositionTable:
+    '''
+    Fixed-size table of search results indexed by Zobrist hash.
+    Each entry holds the depth searched, the bound type, the value and the best line.
+
+        Parameters:
+            size (int): number of slots.
+            replacement (str): "depth" keeps the deeper of two colliding entries unless the old one
+                               is from an earlier search, "always" keeps the newest.
+            fold_symmetry (bool): mirrored and rotated positions share entries.
+    '''
+    def __init__(self, size=2**18, replacement="depth", fold_symmetry=False):
+        if replacement not in ("depth", "always"):
+            raise ValueError(f"Unknown replacement policy {replacement}")
+        self.size = size
+        self.replacement = replacement
+        self.fold_symmetry = fold_symmetry
+        self.slots = [None] * size
+        self.generation = 0
+        self.hits = self.stores = 0
+
+
+    def new_search(self):
+        '''Ages the current entries so that the depth policy lets the next search replace them'''
+        self.generation += 1
+
+
+    def key(self, board):
+        '''
+        Returns the hash of the board and the symmetry mapping its squares to the stored frame.
+        '''
+        if not self.fold_symmetry:
+            return board.hash, 0
+        (black, white), k = canonical(*board.bitboards())
+        return zobrist_hash(black, white, board.turn < 0), k
+
+
+    def get(self, key, k=0, tag=None):
+        '''
+        Returns (depth, flag, value, line) for the key, or None.
+        The line is translated back from the stored frame with symmetry k.
+        '''
+        entry = self.slots[key % self.size]
+        if entry is None or entry[0] != key or entry[5] != tag:
+            return None
+        self.hits += 1
+        _, depth, flag, value, line, _, _ = entry
+        if k:
+            line = [INVERSE_MAPS[k][square] for square in line]
+        return depth, flag, value, line
+
+
+    def put(self, key, depth, flag, value, line, k=0, tag=None):
+        '''
+        Stores a result. line holds squares (r*8 + c) and is translated to the stored frame with symmetry k.
+        tag separates results of different evaluation functions.
+        '''
+        index = key % self.size
+        old = self.slots[index]
+        if self.replacement == "depth" and old is not None and old[0] != key \
+                and old[6] == self.generation and old[1] > depth:
+            return
+        if k:
+            line = [SQUARE_MAPS[k][square] for square in line]
+        self.slots[index] = (key, depth, flag, value, line, tag, self.generation)
+        self.stores += 1
+
+
+    def clear(self):
+        self.slots = [None] * self.size
@@ -0,0 +1,35 @@
+from othello.board import Board
+from othello.renderer import get_renderer
+from utils.animation import encode_gif
+from PIL import Image
+import csv, io, os
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+PUZZLES_PATH = os.path.join(REPO_ROOT, "data", "othello_puzzles.csv")
+
+
+def solution_frames(puzzle):
+    board = Board(puzzle["board_state"])
+    renderer = get_renderer()
+    return [renderer.render(*board.bitboards())] + renderer.render_line(board, puzzle["solution_line"].split(" "))
+
+
+def plain_gif(frames):
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format="GIF", save_all=True, append_images=frames[1:], duration=900, loop=0)
+    return buffer.getvalue()
+
+
+def test_gif_no_larger_than_plain_encoding(monkeypatch):
+    # The renderer loads its assets relative to the repository root, like the bot
+    monkeypatch.chdir(REPO_ROOT)
+    with open(PUZZLES_PATH, newline="") as f:
+        puzzles = list(csv.DictReader(f))[:5]
+    for puzzle in puzzles:
+        frames = solution_frames(puzzle)
+        gif = encode_gif(frames, duration=900, loop=0)
+        assert len(gif) <= len(plain_gif(frames))
+
+        decoded = Image.open(io.BytesIO(gif))
+        assert decoded.n_frames == len(frames)
+        assert decoded.size == frames[0].size
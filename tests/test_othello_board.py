@@ -0,0 +1,51 @@
+from othello.board import ArrayBoard, BitBoard
+from othello.transposition import zobrist_hash
+import random
+
+
+def snapshot(board):
+    return (board.get_board_state(), board.bitboards(), board.turn, board.move, board.hash,
+            int(board.black_disc_count), int(board.white_disc_count))
+
+
+def assert_same(array, bit):
+    assert snapshot(array) == snapshot(bit)
+    assert array.all_legal_moves() == bit.all_legal_moves()
+    assert array.all_legal_moves(-array.turn) == bit.all_legal_moves(-bit.turn)
+    assert array.mobility(array.turn) == bit.mobility(bit.turn)
+    assert array.check_game_over() == bit.check_game_over()
+
+
+def test_random_games_match_array_board():
+    rng = random.Random(2024)
+    for _ in range(30):
+        array, bit = ArrayBoard(), BitBoard()
+        while not bit.check_game_over():
+            assert_same(array, bit)
+            move = rng.choice(sorted(bit.all_legal_moves()))
+            array.push(move)
+            bit.push(move)
+        assert_same(array, bit)
+        assert array.get_score() == bit.get_score()
+
+
+def test_pop_restores_position():
+    rng = random.Random(7)
+    board = BitBoard()
+    history = []
+    while not board.check_game_over():
+        history.append(snapshot(board))
+        board.push(rng.choice(sorted(board.all_legal_moves())))
+    while history:
+        board.pop()
+        assert snapshot(board) == history.pop()
+
+
+def test_incremental_hash_and_board_state():
+    rng = random.Random(11)
+    board = BitBoard()
+    while not board.check_game_over():
+        assert board.hash == zobrist_hash(*board.bitboards(), board.turn == BitBoard.WHITE)
+        copy = BitBoard(board.get_board_state())
+        assert (copy.bitboards(), copy.turn, copy.hash) == (board.bitboards(), board.turn, board.hash)
+        board.push(rng.choice(sorted(board.all_legal_moves())))
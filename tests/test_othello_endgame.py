@@ -0,0 +1,65 @@
+from othello.board import Board
+from othello.endgame import EndgameSolver, SearchTimeout
+from othello import minimax
+import csv, os, pytest
+
+PUZZLES_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "data", "othello_puzzles.csv")
+with open(PUZZLES_PATH, newline="") as f:
+    PUZZLES = list(csv.DictReader(f))[:12]
+
+
+def reference_score(board, alpha=-64, beta=64):
+    '''Plain negamax over Board moves, final margin of the player to move'''
+    if board.check_game_over():
+        return (board.black_disc_count - board.white_disc_count) * board.turn
+    best = -65
+    for move in sorted(board.all_legal_moves()):
+        turn = board.turn
+        board.push(move)
+        # Board.push passes for the opponent when they have no move
+        if board.turn == turn:
+            score = reference_score(board, alpha, beta)
+        else:
+            score = -reference_score(board, -beta, -alpha)
+        board.pop()
+        best = max(best, score)
+        alpha = max(alpha, score)
+        if alpha >= beta:
+            break
+    return best
+
+
+def player_bits(board):
+    black, white = board.bitboards()
+    return (black, white) if board.turn == Board.BLACK else (white, black)
+
+
+@pytest.mark.parametrize("puzzle", PUZZLES, ids=lambda puzzle: puzzle["board_state"])
+def test_solver_matches_reference(puzzle):
+    board = Board(puzzle["board_state"])
+    solver = EndgameSolver()
+    score = solver.solve(*player_bits(board))
+    assert score == reference_score(board)
+    assert solver.wld(*player_bits(board)) == (score > 0) - (score < 0)
+
+    # Replaying the principal variation reaches the solved margin
+    turn = board.turn
+    for square in solver.principal_variation(*player_bits(board), score):
+        board.push(divmod(square, 8))
+    assert board.check_game_over()
+    assert (board.black_disc_count - board.white_disc_count) * turn == score
+
+
+@pytest.mark.parametrize("puzzle", PUZZLES, ids=lambda puzzle: puzzle["board_state"])
+def test_best_moves_match_puzzle_evaluations(puzzle):
+    moves = minimax.find_best_moves(Board(puzzle["board_state"]), n=4, tt=None)
+    assert [int(move["eval"]) for move in moves] == [int(x) for x in puzzle["evaluations"].split(" ")]
+    assert moves[0]["move"] == puzzle["move_choices"].split(" ")[0]
+    wld = minimax.find_best_moves(Board(puzzle["board_state"]), n=4, tt=None, exact=False)
+    assert sorted(move["eval"] for move in wld) == sorted((move["eval"] > 0) - (move["eval"] < 0) for move in moves)
+
+
+def test_solver_budget():
+    board = Board(PUZZLES[0]["board_state"])
+    with pytest.raises(SearchTimeout):
+        EndgameSolver(node_limit=10).solve(*player_bits(board))
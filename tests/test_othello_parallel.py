@@ -0,0 +1,24 @@
+from othello.board import Board
+from othello import minimax
+import csv, os, pytest
+
+PUZZLES_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "data", "othello_puzzles.csv")
+with open(PUZZLES_PATH, newline="") as f:
+    PUZZLES = list(csv.DictReader(f))[:8]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def search_pools():
+    yield
+    minimax.shutdown_search_pools()
+
+
+@pytest.mark.parametrize("exact", [True, False])
+@pytest.mark.parametrize("n", [1, 2, 4])
+def test_parallel_matches_serial(n, exact):
+    for puzzle in PUZZLES:
+        serial = minimax.find_best_moves(Board(puzzle["board_state"]), n=n, tt=None, workers=1, exact=exact)
+        parallel = minimax.find_best_moves(Board(puzzle["board_state"]), n=n, tt=None, workers=2, exact=exact)
+        assert parallel == serial
+    # The positions are deep enough for the root moves to go to the search pool
+    assert 2 in minimax.SEARCH_POOLS
@@ -0,0 +1,64 @@
+import numpy as np
+import chess, pytest
+from utils.puzzle_store import (RECORD, PuzzleStore, pack_fen, unpack_fen, encode_move, decode_move,
+                                pack_moves, unpack_moves, pack_themes, write_store, THEMES)
+
+FENS = [
+    chess.STARTING_FEN,
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+    "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+    "r3k2r/8/8/8/8/8/8/R3K2R b Kq - 17 41",
+    "8/2P5/8/8/8/2k5/8/2K5 w - - 0 68",
+    "6k1/5ppp/8/8/8/8/5PPP/3R2K1 b - - 99 250",
+]
+
+
+@pytest.mark.parametrize("fen", FENS)
+def test_fen_round_trip(fen):
+    record = np.zeros(1, dtype=RECORD)[0]
+    pack_fen(fen, record)
+    assert unpack_fen(record) == fen
+
+
+@pytest.mark.parametrize("uci", ["e2e4", "g1f3", "e1g1", "a7a8q", "h2h1n", "b7c8r", "d2d1b", "h8a1"])
+def test_move_round_trip(uci):
+    assert decode_move(encode_move(uci)) == uci
+
+
+def test_moves_round_trip():
+    record = np.zeros(1, dtype=RECORD)[0]
+    moves = "e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7 f1e1 b7b5 a4b3 d7d6 c2c3 e8g8"
+    pack_moves(moves, record)
+    assert unpack_moves(record) == moves
+
+
+def test_themes_mask():
+    mask = pack_themes("fork mateIn2 short")
+    assert [theme for i, theme in enumerate(THEMES) if mask & (1 << i)] == ["fork", "mateIn2", "short"]
+
+
+def test_store_round_trip(tmp_path):
+    rows = [{"FEN": fen, "Moves": "e2e4 e7e5", "Rating": str(1000 + i), "Themes": "opening"}
+            for i, fen in enumerate(FENS)]
+    rows.append({"FEN": chess.STARTING_FEN, "Moves": " ".join(["g1f3 g8f6 f3g1 f6g8"] * 5), "Rating": "1500"})
+    store_path = str(tmp_path / "puzzles.bin")
+    # Puzzles longer than the record holds are skipped, chunks smaller than the input are flushed
+    assert write_store(rows, store_path, chunk_size=4) == len(FENS)
+
+    store = PuzzleStore(store_path)
+    assert len(store) == len(FENS)
+    for i, fen in enumerate(FENS):
+        assert store.get(i) == (fen, "e2e4 e7e5", 1000 + i, None)
+
+
+def test_sample_missing_theme(tmp_path):
+    from utils.puzzle_store import build_index
+    rows = [{"FEN": chess.STARTING_FEN, "Moves": "e2e4 e7e5", "Rating": str(rating), "Themes": "fork notATheme"}
+            for rating in (900, 1500, 2100)]
+    store_path, index_path = str(tmp_path / "puzzles.bin"), str(tmp_path / "puzzles.idx")
+    write_store(rows, store_path)
+    build_index(store_path, index_path)
+    store = PuzzleStore(store_path, index_path)
+    assert store.sample(1500, "fork")[2] == 1500
+    assert store.sample(theme="fork") is not None
+    assert store.sample(1500, "pin") is None
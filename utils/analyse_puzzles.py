@@ -0,0 +1,104 @@
+"""
+Precomputes the wrong answers of every chess puzzle so that serving a puzzle needs no engine call.
+
+    python -m utils.analyse_puzzles [--workers N] [--depth 13]
+
+Results are written into the puzzle store in place. Each result is also kept in the Stockfish
+analysis cache, so an interrupted run resumes where it stopped, and re-running after the
+store was recompiled with new puzzles only searches the new positions.
+"""
+from utils.analysis_cache import AnalysisCache
+from utils.engine_pool import PooledStockfish
+from utils.puzzle_store import PuzzleStore, unpack_fen, unpack_moves, encode_move, ANALYSED, MAX_DISTRACTORS
+from multiprocessing import Pool
+from tqdm import tqdm
+import utils.setup as setup
+import argparse, chess, logging, os
+
+ANALYSIS_PATH = "./data/analysis_cache.db" # Shared with ChessHandler
+RATING = 2000 # Same search as the live puzzle choices in ChessHandler.generate_puzzle
+TOP_MOVES = 5
+
+_engine = None
+_analysis = None
+
+
+def init_worker(stockfish_path, hash_mb):
+    global _engine, _analysis
+    _engine = PooledStockfish(path=stockfish_path, parameters={"Hash": hash_mb, "Threads": 1})
+    _engine.set_elo_rating(RATING)
+    _analysis = AnalysisCache(ANALYSIS_PATH, memory_entries=0)
+
+
+def analyse_batch(batch, depth):
+    """
+    Finds the distractors of a batch of puzzles.
+
+        Parameters:
+            batch (list): (puzzle number, FEN, UCI moves) tuples.
+            depth (int): search depth.
+
+        Returns:
+            results (list): (puzzle number, distractors in UCI format) tuples.
+    """
+    results = []
+    for index, fen, moves in batch:
+        moves = moves.split(" ")
+        board = chess.Board(fen)
+        board.push_uci(moves[0])
+        top_moves = _analysis.get("top_moves", board, RATING, depth, TOP_MOVES)
+        if top_moves is None:
+            _engine.set_fen_position(board.fen())
+            _engine.set_depth(depth)
+            top_moves = _engine.get_top_moves(TOP_MOVES)
+            _analysis.put("top_moves", board, RATING, depth, top_moves, TOP_MOVES)
+        distractors = [move["Move"] for move in top_moves if move["Move"] != moves[1]]
+        results.append((index, distractors[:MAX_DISTRACTORS]))
+    return results
+
+
+def analyse_store(store_path, stockfish_path, workers=None, depth=13, hash_mb=16, batch_size=64, flush_every=50):
+    """
+    Computes the distractors of every puzzle not analysed yet, using one Stockfish process per worker.
+
+        Returns:
+            count (int): number of puzzles analysed.
+    """
+    store = PuzzleStore(store_path, writable=True)
+    records = store.records
+    pending = [int(i) for i in (records["flags"] & ANALYSED == 0).nonzero()[0]]
+    logging.info(f"{len(pending)} of {len(records)} puzzles left to analyse.")
+    batches = ([(i, unpack_fen(records[i]), unpack_moves(records[i])) for i in pending[start:start + batch_size]]
+               for start in range(0, len(pending), batch_size))
+
+    workers = workers or os.cpu_count() or 1
+    count = 0
+    with Pool(workers, initializer=init_worker, initargs=(stockfish_path, hash_mb)) as pool, \
+            tqdm(total=len(pending), unit="puzzle") as progress:
+        for done, results in enumerate(pool.imap_unordered(_analyse_batch, ((batch, depth) for batch in batches)), 1):
+            for index, distractors in results:
+                codes = [encode_move(uci) for uci in distractors] + [0] * (MAX_DISTRACTORS - len(distractors))
+                records["distractors"][index] = codes
+                records["flags"][index] |= ANALYSED
+            count += len(results)
+            progress.update(len(results))
+            if done % flush_every == 0:
+                records.flush()
+    records.flush()
+    return count
+
+
+def _analyse_batch(args):
+    return analyse_batch(*args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Precompute chess puzzle distractors.")
+    parser.add_argument("--store", default=setup.PUZZLE_STORE_PATH)
+    parser.add_argument("--stockfish", default=setup.STOCKFISH_PATH)
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of cores")
+    parser.add_argument("--depth", type=int, default=13)
+    args = parser.parse_args()
+    count = analyse_store(args.store, args.stockfish, workers=args.workers, depth=args.depth)
+    logging.info(f"Analysed {count} puzzles.")
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+import json, logging, os, sqlite3, threading
+
+
+class AnalysisCache:
+    """
+    Cache of Stockfish results keyed by position and search parameters:
+    an in-process LRU in front of a SQLite file shared by every process on the host.
+    A result searched to some depth also answers requests for any shallower depth.
+    """
+    def __init__(self, path, memory_entries=50000):
+        """
+            Parameters:
+                path (str): SQLite database file, None to keep results in memory only.
+                memory_entries (int): number of results kept in the in-process tier.
+        """
+        self.path = path
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict() # (kind, epd, elo, multipv) -> (depth, result)
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self.db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute("""CREATE TABLE IF NOT EXISTS analysis (
+                                   kind TEXT, epd TEXT, elo INTEGER, multipv INTEGER, depth INTEGER, result TEXT,
+                                   PRIMARY KEY (kind, epd, elo, multipv))""")
+            except sqlite3.Error:
+                logging.exception("Failed to open analysis cache, keeping results in memory only.")
+                self.db = None
+
+
+    @staticmethod
+    def key(kind, board, elo, multipv):
+        # EPD drops the move counters and keeps en passant only when it is legal
+        return (kind, board.epd(), elo, multipv)
+
+
+    def get(self, kind, board, elo, depth, multipv=1):
+        """
+        Returns a cached result searched to at least depth, or None.
+
+            Parameters:
+                kind (str): type of search, e.g. "top_moves" or "best_move".
+                board (chess.Board): searched position.
+                elo (int): engine rating.
+                depth (int): minimum search depth.
+                multipv (int): number of lines searched.
+        """
+        key = self.key(kind, board, elo, multipv)
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and entry[0] >= depth:
+                self.memory.move_to_end(key)
+                self.hits["memory"] += 1
+                return entry[1]
+            row = None
+            if self.db:
+                try:
+                    row = self.db.execute("SELECT depth, result FROM analysis WHERE kind=? AND epd=? AND elo=? AND multipv=?",
+                                          key).fetchone()
+                except sqlite3.Error:
+                    logging.exception("Failed to read analysis cache.")
+            if row and row[0] >= depth:
+                result = json.loads(row[1])
+                self._put_memory(key, row[0], result)
+                self.hits["disk"] += 1
+                return result
+            self.misses += 1
+            return None
+
+
+    def put(self, kind, board, elo, depth, result, multipv=1):
+        """
+        Stores a search result unless a deeper one is already cached.
+        """
+        key = self.key(kind, board, elo, multipv)
+        with self.lock:
+            self._put_memory(key, depth, result)
+            if not self.db:
+                return
+            try:
+                self.db.execute("""INSERT INTO analysis VALUES (?, ?, ?, ?, ?, ?)
+                                   ON CONFLICT (kind, epd, elo, multipv) DO UPDATE
+                                   SET depth=excluded.depth, result=excluded.result WHERE excluded.depth >= depth""",
+                                key + (depth, json.dumps(result)))
+            except sqlite3.Error:
+                logging.exception("Failed to write analysis cache.")
+
+
+    def _put_memory(self, key, depth, result):
+        entry = self.memory.get(key)
+        if entry and entry[0] > depth:
+            self.memory.move_to_end(key)
+            return
+        self.memory[key] = (depth, result)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+
+    def stats(self):
+        with self.lock:
+            hits = self.hits["memory"] + self.hits["disk"]
+            total = hits + self.misses
+            return {"memory_hits": self.hits["memory"], "disk_hits": self.hits["disk"], "misses": self.misses,
+                    "hit_rate": hits / total if total else 0.0, "memory_entries": len(self.memory)}
@@ -0,0 +1,35 @@
+from PIL import Image
+import io
+
+
+def encode_gif(frames, duration=900, loop=0, colors=256):
+    """
+    Encodes frames into an animated GIF entirely in memory.
+
+    All frames are quantised against one palette built from every frame, so unchanged pixels
+    keep identical palette indices between frames. Pillow then stores each frame after the
+    first as the bounding box of its difference from the previous frame.
+
+        Parameters:
+            frames (list): PIL images of equal size.
+            duration (int): display time of each frame in milliseconds.
+            loop (int): number of loops, 0 to loop forever.
+            colors (int): palette size.
+
+        Returns:
+            gif (bytes): encoded animation.
+    """
+    frames = [frame.convert("RGB") for frame in frames]
+    width, height = frames[0].size
+
+    # Build the shared palette from all frames stacked into one strip
+    strip = Image.new("RGB", (width, height * len(frames)))
+    for i, frame in enumerate(frames):
+        strip.paste(frame, (0, i * height))
+    palette = strip.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+
+    quantized = [frame.quantize(palette=palette, dither=Image.Dither.NONE) for frame in frames]
+    buffer = io.BytesIO()
+    quantized[0].save(buffer, format="GIF", save_all=True, append_images=quantized[1:],
+                      duration=duration, loop=loop, disposal=1, optimize=True)
+    return buffer.getvalue()
@@ -0,0 +1,235 @@
+from stockfish import Stockfish, StockfishException
+from contextlib import contextmanager, asynccontextmanager
+import asyncio, chess, logging, os, queue, threading
+
+
+class PooledStockfish(Stockfish):
+    """
+    Stockfish process that can report whether it is still responsive.
+    """
+    def is_alive(self) -> bool:
+        if self._stockfish.poll() is not None:
+            return False
+        try:
+            self._is_ready()
+        except (StockfishException, BrokenPipeError, OSError):
+            return False
+        return True
+
+    def quit(self) -> None:
+        self._put("quit")
+
+    def search(self, num_top_moves=1, movetime=None, depth=None):
+        """
+        Searches the current position until movetime milliseconds have passed or depth is reached,
+        whichever comes first.
+
+            Parameters:
+                num_top_moves (int): number of lines (MultiPV) to search.
+                movetime (int): wall-clock budget in milliseconds, None for no limit.
+                depth (int): maximum depth, defaults to the engine depth.
+
+            Returns:
+                top_moves (list): best lines of the deepest iteration completed for every line,
+                                  in the get_top_moves format.
+                bestmove (str): move played by the engine, which differs from the first line
+                                when UCI_LimitStrength is on. None if there are no legal moves.
+                depth (int): depth of the lines, 0 if no iteration completed.
+        """
+        depth = depth or int(self.depth)
+        old_multipv = self._parameters["MultiPV"]
+        self._set_multipv(num_top_moves)
+        try:
+            iterations, bestmove = self._go_iterations(depth, movetime)
+        finally:
+            self._set_multipv(old_multipv)
+        if bestmove is None:
+            return [], None, 0
+
+        lines_count = max(len(lines) for lines in iterations.values()) if iterations else 0
+        complete = [d for d, lines in iterations.items() if len(lines) == lines_count]
+        if not complete:
+            return [{"Move": bestmove, "Centipawn": None, "Mate": None}], bestmove, 0
+        reached = max(complete)
+        multiplier = 1 if " w " in self.get_fen_position() else -1
+        top_moves = []
+        for _, line in sorted(iterations[reached].items()):
+            top_moves.append({
+                "Move": line[line.index("pv") + 1],
+                "Centipawn": int(line[line.index("cp") + 1]) * multiplier if "cp" in line else None,
+                "Mate": int(line[line.index("mate") + 1]) * multiplier if "mate" in line else None,
+            })
+        return top_moves, bestmove, reached
+
+    def _set_multipv(self, multipv):
+        if multipv != self._parameters["MultiPV"]:
+            self._set_option("MultiPV", multipv)
+            self._parameters.update({"MultiPV": multipv})
+
+    def _go_iterations(self, depth, movetime):
+        """
+        Runs a search and collects the final info line of every (depth, multipv) pair.
+        """
+        self._put(f"go depth {depth}" + (f" movetime {int(movetime)}" if movetime else ""))
+        iterations = {} # depth -> {multipv: info line}
+        while True:
+            line = self._read_line().split(" ")
+            if line[0] == "bestmove":
+                bestmove = None if line[1] == "(none)" else line[1]
+                break
+            # Bound lines come from aspiration windows and do not hold a final score
+            if line[0] != "info" or "pv" not in line or "depth" not in line \
+                    or "lowerbound" in line or "upperbound" in line:
+                continue
+            multipv = int(line[line.index("multipv") + 1]) if "multipv" in line else 1
+            iterations.setdefault(int(line[line.index("depth") + 1]), {})[multipv] = line
+        return iterations, bestmove
+
+
+class EnginePool:
+    """
+    Pool of Stockfish processes shared by concurrent chess requests.
+    Each search checks out its own engine so that FEN/ELO/depth state is never shared.
+    """
+    def __init__(self, stockfish_path, size=None, hash_mb=64, threads=1, depth=15, warmup_depth=10):
+        """
+            Parameters:
+                stockfish_path (str): path to the stockfish binary.
+                size (int): number of engine processes, defaults to host cores // threads.
+                hash_mb (int): transposition table size of each engine in MB.
+                threads (int): search threads of each engine.
+                depth (int): default search depth.
+                warmup_depth (int): depth of the search run on each engine at boot, 0 to skip.
+        """
+        self.stockfish_path = stockfish_path
+        self.size = size or max(1, (os.cpu_count() or 1) // threads)
+        self.parameters = {"Hash": hash_mb, "Threads": threads}
+        self.depth = depth
+        self.warmup_depth = warmup_depth
+        self.restarts = 0
+
+        self._idle = queue.Queue()
+        self._engines = []
+        self._lock = threading.Lock()
+        for _ in range(self.size):
+            engine = self._spawn()
+            self._engines.append(engine)
+            self._idle.put(engine)
+
+
+    def _spawn(self):
+        """
+        Starts a new engine process and warms it up.
+        """
+        engine = PooledStockfish(path=self.stockfish_path, depth=self.depth, parameters=self.parameters)
+        if self.warmup_depth:
+            engine.set_fen_position(chess.STARTING_FEN)
+            engine.set_depth(self.warmup_depth)
+            engine.get_best_move()
+            engine.set_depth(self.depth)
+        return engine
+
+
+    def _replace(self, engine):
+        """
+        Restarts a dead engine, returning its replacement.
+        """
+        logging.warning("Stockfish engine is unresponsive, restarting it.")
+        new_engine = self._spawn()
+        with self._lock:
+            if engine in self._engines:
+                self._engines.remove(engine)
+            self._engines.append(new_engine)
+            self.restarts += 1
+        return new_engine
+
+
+    def checkout(self, timeout=None):
+        """
+        Blocks until an engine is idle and returns it. Dead engines are restarted first.
+
+            Parameters:
+                timeout (float): seconds to wait for an idle engine, None to wait forever.
+
+            Returns:
+                engine (PooledStockfish): engine reserved for the caller until checkin.
+        """
+        engine = self._idle.get(timeout=timeout)
+        if not engine.is_alive():
+            try:
+                engine = self._replace(engine)
+            except Exception:
+                self._idle.put(engine)
+                raise
+        return engine
+
+
+    def checkin(self, engine):
+        """
+        Returns an engine to the pool, restarting it if it died during the search.
+        """
+        if not engine.is_alive():
+            try:
+                engine = self._replace(engine)
+            except Exception:
+                logging.exception("Failed to restart Stockfish engine.")
+        engine.set_depth(self.depth)
+        self._idle.put(engine)
+
+
+    @contextmanager
+    def engine(self, timeout=None):
+        engine = self.checkout(timeout)
+        try:
+            yield engine
+        finally:
+            self.checkin(engine)
+
+
+    async def checkout_async(self, timeout=None):
+        """
+        Awaitable version of checkout that does not block the event loop while waiting.
+        """
+        return await asyncio.to_thread(self.checkout, timeout)
+
+
+    @asynccontextmanager
+    async def engine_async(self, timeout=None):
+        engine = await self.checkout_async(timeout)
+        try:
+            yield engine
+        finally:
+            await asyncio.to_thread(self.checkin, engine)
+
+
+    def health_check(self):
+        """
+        Checks every idle engine and restarts the dead ones.
+
+            Returns:
+                restarted (int): number of engines that were restarted.
+        """
+        restarted = 0
+        for _ in range(self._idle.qsize()):
+            try:
+                engine = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if not engine.is_alive():
+                try:
+                    engine = self._replace(engine)
+                    restarted += 1
+                except Exception:
+                    logging.exception("Failed to restart Stockfish engine.")
+            self._idle.put(engine)
+        return restarted
+
+
+    def close(self):
+        with self._lock:
+            engines, self._engines = self._engines, []
+        for engine in engines:
+            try:
+                engine.quit()
+            except Exception:
+                pass
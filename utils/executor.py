@@ -0,0 +1,84 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio, os
+
+
+class JobExecutor:
+    """
+    Runs blocking handler work off the asyncio event loop.
+    CPU-bound work (pure python search, rendering) goes to a process pool,
+    blocking I/O and out-of-process engine calls go to a thread pool.
+    """
+    def __init__(self, processes=None, threads=None, timeout=None):
+        """
+            Parameters:
+                processes (int): size of the process pool, defaults to host cores.
+                threads (int): size of the thread pool, defaults to the ThreadPoolExecutor default.
+                timeout (float): default per-job timeout in seconds, None for no timeout.
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self.timeout = timeout
+        self.pending = 0 # Jobs submitted but not finished, used to tell how busy the bot is
+        self.process_pool = ProcessPoolExecutor(max_workers=self.processes)
+        self.thread_pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="job")
+
+
+    async def _run(self, pool, fn, args, timeout):
+        future = pool.submit(fn, *args)
+        timeout = self.timeout if timeout is None else timeout
+        self.pending += 1
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Only jobs that have not started yet can be withdrawn from the pool
+            future.cancel()
+            raise
+        finally:
+            self.pending -= 1
+
+
+    async def run_process(self, fn, *args, timeout=None):
+        """
+        Runs fn(*args) in the process pool. fn, its arguments and its result must be picklable.
+        Raises asyncio.TimeoutError if the job does not finish within timeout seconds.
+        """
+        return await self._run(self.process_pool, fn, args, timeout)
+
+
+    async def run_thread(self, fn, *args, timeout=None):
+        """
+        Runs fn(*args) in the thread pool.
+        Raises asyncio.TimeoutError if the job does not finish within timeout seconds.
+        """
+        return await self._run(self.thread_pool, fn, args, timeout)
+
+
+    def shutdown(self, wait=False):
+        self.process_pool.shutdown(wait=wait, cancel_futures=True)
+        self.thread_pool.shutdown(wait=wait, cancel_futures=True)
+
+
+# --------------------------- Worker Functions --------------------------- #
+
+
+_handlers = {}
+
+def call_handler(handler_cls, init_args, method, args=()):
+    """
+    Calls a handler method inside a worker process.
+    Each worker builds its own handler instance once and reuses it for later jobs.
+    Open file handles in the result are read into bytes so that the result can be pickled.
+    """
+    key = (handler_cls, init_args)
+    if key not in _handlers:
+        _handlers[key] = handler_cls(*init_args)
+    result = getattr(_handlers[key], method)(*args)
+    if isinstance(result, tuple):
+        result = tuple(to_bytes(x) for x in result)
+    return result
+
+
+def to_bytes(obj):
+    if hasattr(obj, "read"):
+        with obj:
+            return obj.read()
+    return obj
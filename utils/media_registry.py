@@ -0,0 +1,112 @@
+from collections import OrderedDict
+from telegram.error import BadRequest
+from utils.executor import to_bytes
+import hashlib, logging
+
+# Parts of the BadRequest messages Telegram gives for file ids it no longer accepts
+FILE_ID_ERRORS = ("file identifier", "file_id", "file reference", "type of file mismatch", "can't use file of type")
+
+
+class MediaRegistry:
+    """
+    Remembers the file_id Telegram assigns to each uploaded image or animation,
+    keyed by a hash of its content, so that sending the same bytes again
+    only sends the id instead of re-uploading the file.
+    """
+    def __init__(self, max_entries=20000):
+        """
+            Parameters:
+                max_entries (int): number of file ids kept, least recently used are dropped first.
+        """
+        self.max_entries = max_entries
+        self.file_ids = OrderedDict() # content hash -> file_id
+        self.hits = 0
+        self.uploads = 0
+        self.rejected = 0
+
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+
+    @staticmethod
+    def get_file_id(message):
+        """
+        Returns the file_id of the media attached to a sent message, or None.
+        """
+        if message.photo:
+            return message.photo[-1].file_id # Largest size
+        for media in (message.animation, message.document, message.video):
+            if media:
+                return media.file_id
+        return None
+
+
+    @staticmethod
+    def is_file_id_error(error):
+        message = error.message.lower()
+        return any(part in message for part in FILE_ID_ERRORS)
+
+
+    async def send(self, send_fn, field, media, **kwargs):
+        """
+        Sends media with a bot send method, reusing a known file_id when possible.
+
+            Parameters:
+                send_fn (coroutine function): e.g. bot.send_photo or bot.send_animation.
+                field (str): name of the media argument of send_fn, e.g. "photo".
+                media (bytes or file): content to send.
+                **kwargs: other arguments of send_fn.
+
+            Returns:
+                message (telegram.Message): the sent message.
+        """
+        data = to_bytes(media)
+        key = self.digest(data)
+        file_id = self.file_ids.get(key)
+        if file_id:
+            try:
+                message = await send_fn(**{field: file_id}, **kwargs)
+                self.file_ids.move_to_end(key)
+                self.hits += 1
+                return message
+            except BadRequest as e:
+                # Only an expired or unknown id is worth re-uploading, other errors would fail again
+                if not self.is_file_id_error(e):
+                    raise
+                logging.warning(f"Telegram rejected cached file_id {file_id}, re-uploading.")
+                self.file_ids.pop(key, None)
+                self.rejected += 1
+
+        message = await send_fn(**{field: data}, **kwargs)
+        self.uploads += 1
+        file_id = self.get_file_id(message)
+        if file_id:
+            self.put(key, file_id)
+        return message
+
+
+    def put(self, key, file_id):
+        self.file_ids[key] = file_id
+        self.file_ids.move_to_end(key)
+        while len(self.file_ids) > self.max_entries:
+            self.file_ids.popitem(last=False)
+
+
+    def dump(self):
+        """
+        Returns the registry as a JSON serializable dict, oldest entries first.
+        """
+        return dict(self.file_ids)
+
+
+    def load(self, file_ids):
+        for key, file_id in file_ids.items():
+            self.put(key, file_id)
+
+
+    def stats(self):
+        total = self.hits + self.uploads
+        return {"entries": len(self.file_ids), "hits": self.hits, "uploads": self.uploads,
+                "rejected": self.rejected, "hit_rate": self.hits / total if total else 0.0}
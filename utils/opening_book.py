@@ -0,0 +1,100 @@
+from collections import Counter
+import chess, chess.pgn, chess.polyglot, logging, os, random, struct
+
+
+class OpeningBook:
+    """
+    Polyglot opening book. The file is memory-mapped and binary-searched
+    by Zobrist key, so lookups cost a few page reads and no engine time.
+    """
+    def __init__(self, path, max_ply=24):
+        """
+            Parameters:
+                path (str): Polyglot .bin file, a missing file gives an empty book.
+                max_ply (int): the book is not consulted after this many half-moves.
+        """
+        self.path = path
+        self.max_ply = max_ply
+        self.reader = None
+        self.hits = 0
+        if path and os.path.isfile(path) and os.path.getsize(path) > 0:
+            self.reader = chess.polyglot.open_reader(path)
+        else:
+            logging.info("No opening book found, using the engine for every move.")
+
+
+    def entries(self, board):
+        """
+        Returns the legal book entries of the position, most played first.
+        """
+        if self.reader is None or board.ply() > self.max_ply:
+            return []
+        entries = sorted(self.reader.find_all(board), key=lambda entry: entry.weight, reverse=True)
+        if entries:
+            self.hits += 1
+        return entries
+
+
+    def choose(self, board):
+        """
+        Picks a book move at random, weighted by how often it was played.
+
+            Returns:
+                move (chess.Move): book move, None when the position is not in the book.
+        """
+        entries = self.entries(board)
+        if not entries:
+            return None
+        return random.choices([entry.move for entry in entries], weights=[entry.weight for entry in entries])[0]
+
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+def encode_move(board, move):
+    """
+    Encodes a move in Polyglot's 16 bit format, with castling written as king takes rook.
+    """
+    move = board._to_chess960(move)
+    promotion = move.promotion - 1 if move.promotion else 0
+    return move.to_square | move.from_square << 6 | promotion << 12
+
+
+def build_book(pgn_path, book_path, max_ply=24, min_count=2):
+    """
+    Compiles a Polyglot book from the opening moves of every game in a PGN file.
+    Weights are the number of games playing the move, scaled to fit 16 bits.
+
+        Parameters:
+            pgn_path (str): games to read.
+            book_path (str): Polyglot file to write.
+            max_ply (int): number of half-moves read from each game.
+            min_count (int): moves played in fewer games are left out.
+
+        Returns:
+            count (int): number of book entries written.
+    """
+    counts = Counter()
+    with open(pgn_path, encoding="utf-8", errors="replace") as f:
+        while True:
+            game = chess.pgn.read_game(f)
+            if game is None:
+                break
+            board = game.board()
+            for ply, move in enumerate(game.mainline_moves()):
+                if ply >= max_ply:
+                    break
+                counts[(chess.polyglot.zobrist_hash(board), encode_move(board, move))] += 1
+                board.push(move)
+
+    entries = sorted((key, raw_move, count) for (key, raw_move), count in counts.items() if count >= min_count)
+    scale = max([count for _, _, count in entries], default=1) / 0xFFFF
+    temp_path = book_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        for key, raw_move, count in entries:
+            f.write(struct.pack(">QHHI", key, raw_move, max(1, int(count / max(scale, 1))), 0))
+    os.replace(temp_path, book_path)
+    return len(entries)
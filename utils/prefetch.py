@@ -0,0 +1,104 @@
+from utils.executor import to_bytes
+import asyncio, logging
+
+
+class PuzzleBuffer:
+    """
+    Keeps a bounded queue of ready-to-send puzzles for each game so that
+    puzzle commands do not wait on the engine, renderer and GIF encoder.
+    """
+    def __init__(self, handlers, executor, size=5, low_water=2, max_pending=None, throttle_interval=1.0,
+                 max_backoff=300.0):
+        """
+            Parameters:
+                handlers (dict): maps a key (e.g. Task) to the handler generating its puzzles.
+                executor (JobExecutor): executor shared with the rest of the bot.
+                size (int): maximum number of puzzles kept per game.
+                low_water (int): the producer refills a queue once it drops below this.
+                max_pending (int): the producer waits while this many jobs are running, defaults to the process count.
+                throttle_interval (float): seconds between busy checks while throttled, and before
+                                           retrying a failed puzzle.
+                max_backoff (float): longest wait before retrying, the wait doubles with each failure in a row.
+        """
+        self.handlers = handlers
+        self.executor = executor
+        self.size = size
+        self.low_water = low_water
+        self.max_pending = max_pending or executor.processes
+        self.throttle_interval = throttle_interval
+        self.max_backoff = max_backoff
+
+        self.queues = {key: asyncio.Queue(maxsize=size) for key in handlers}
+        self.refill = {key: asyncio.Event() for key in handlers}
+        self.hits = {key: 0 for key in handlers}
+        self.misses = {key: 0 for key in handlers}
+        self.tasks = []
+
+
+    def start(self):
+        """
+        Starts one producer task per game. Must be called from a running event loop.
+        """
+        for key in self.handlers:
+            self.refill[key].set()
+            self.tasks.append(asyncio.create_task(self._produce(key)))
+
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+
+    async def _generate(self, key):
+        puzzle = await self.handlers[key].generate_puzzle_async()
+        return tuple(to_bytes(x) for x in puzzle)
+
+
+    async def _produce(self, key):
+        queue, refill = self.queues[key], self.refill[key]
+        failures = 0
+        while True:
+            await refill.wait()
+            refill.clear()
+            while not queue.full():
+                # Leave the workers to user requests while the bot is busy
+                while self.executor.pending >= self.max_pending:
+                    await asyncio.sleep(self.throttle_interval)
+                try:
+                    puzzle = await self._generate(key)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    backoff = min(self.throttle_interval * 2**failures, self.max_backoff)
+                    failures += 1
+                    logging.exception(f"Failed to prefetch puzzle for {key}, retrying in {backoff:.0f}s.")
+                    await asyncio.sleep(backoff)
+                    continue
+                failures = 0
+                await queue.put(puzzle)
+
+
+    async def get(self, key):
+        """
+        Returns a ready puzzle, generating one on the spot if the buffer is empty.
+        """
+        queue = self.queues[key]
+        try:
+            puzzle = queue.get_nowait()
+            self.hits[key] += 1
+        except asyncio.QueueEmpty:
+            self.misses[key] += 1
+            puzzle = await self._generate(key)
+        if queue.qsize() < self.low_water:
+            self.refill[key].set()
+        return puzzle
+
+
+    def stats(self):
+        """
+        Returns buffered puzzle count, hits and misses for each game.
+        """
+        return {key: {"buffered": self.queues[key].qsize(), "hits": self.hits[key], "misses": self.misses[key]}
+                for key in self.handlers}
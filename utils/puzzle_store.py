@@ -0,0 +1,331 @@
+import numpy as np
+import chess, csv, logging, os, random, struct
+
+MAGIC = b"CHPZ"
+VERSION = 3
+HEADER = struct.Struct("<4sIQ") # magic, version, record count
+MAX_MOVES = 16
+MAX_DISTRACTORS = 4
+ANALYSED = 1 << 5 # flags bit set once the distractors have been computed
+
+# Lichess puzzle themes, each stored as one bit of a record's theme mask
+THEMES = (
+    "advancedPawn", "advantage", "anastasiaMate", "arabianMate", "attackingF2F7", "attraction",
+    "backRankMate", "bishopEndgame", "bodenMate", "capturingDefender", "castling", "clearance",
+    "crushing", "defensiveMove", "deflection", "discoveredAttack", "doubleBishopMate", "doubleCheck",
+    "dovetailMate", "enPassant", "endgame", "equality", "exposedKing", "fork", "hangingPiece",
+    "hookMate", "interference", "intermezzo", "kingsideAttack", "knightEndgame", "long", "master",
+    "masterVsMaster", "mate", "mateIn1", "mateIn2", "mateIn3", "mateIn4", "mateIn5", "middlegame",
+    "oneMove", "opening", "pawnEndgame", "pin", "promotion", "queenEndgame", "queenRookEndgame",
+    "queensideAttack", "quietMove", "rookEndgame", "sacrifice", "short", "skewer", "smotheredMate",
+    "superGM", "trappedPiece", "underPromotion", "veryLong", "xRayAttack", "zugzwang",
+)
+THEME_BITS = {theme: i for i, theme in enumerate(THEMES)}
+
+# Fixed-width puzzle record. Squares are nibble-packed (a1 first), each nibble holds
+# the piece type (1-6) plus 8 for black pieces. Moves are packed as from | to << 6 | promotion << 12.
+# Distractors are wrong answers for the position after the first move, 0 terminated.
+RECORD = np.dtype([
+    ("board", np.uint8, 32),
+    ("flags", np.uint8),        # bit 0: white to move, bits 1-4: castling rights KQkq, bit 5: analysed
+    ("ep", np.uint8),           # en passant square, 255 if none
+    ("halfmove", np.uint8),
+    ("fullmove", np.uint16),
+    ("n_moves", np.uint8),
+    ("moves", np.uint16, MAX_MOVES),
+    ("rating", np.uint16),
+    ("themes", np.uint64),
+    ("distractors", np.uint16, MAX_DISTRACTORS),
+])
+CASTLING = (chess.H1, chess.A1, chess.H8, chess.A8)
+NO_EP = 255
+PIECE_SYMBOLS = {piece_type + (0 if color else 8): chess.Piece(piece_type, color).symbol()
+                 for piece_type in chess.PIECE_TYPES for color in chess.COLORS}
+
+
+def pack_fen(fen, record):
+    board = chess.Board(fen)
+    nibbles = np.zeros(64, dtype=np.uint8)
+    for square, piece in board.piece_map().items():
+        nibbles[square] = piece.piece_type + (0 if piece.color else 8)
+    record["board"] = nibbles[0::2] | (nibbles[1::2] << 4)
+
+    flags = int(board.turn)
+    for i, rook_square in enumerate(CASTLING):
+        if board.castling_rights & chess.BB_SQUARES[rook_square]:
+            flags |= 2 << i
+    record["flags"] = flags
+    record["ep"] = NO_EP if board.ep_square is None else board.ep_square
+    record["halfmove"] = min(board.halfmove_clock, 255)
+    record["fullmove"] = board.fullmove_number
+
+
+def unpack_fen(record):
+    packed = record["board"]
+    nibbles = np.empty(64, dtype=np.uint8)
+    nibbles[0::2] = packed & 0x0F
+    nibbles[1::2] = packed >> 4
+
+    ranks = []
+    for rank in nibbles.reshape(8, 8)[::-1].tolist():
+        fen_rank, empty = "", 0
+        for code in rank:
+            if code == 0:
+                empty += 1
+                continue
+            if empty:
+                fen_rank += str(empty)
+                empty = 0
+            fen_rank += PIECE_SYMBOLS[code]
+        ranks.append(fen_rank + (str(empty) if empty else ""))
+
+    flags = int(record["flags"])
+    turn = "w" if flags & 1 else "b"
+    castling = "".join(symbol for i, symbol in enumerate("KQkq") if flags & (2 << i)) or "-"
+    ep = "-" if record["ep"] == NO_EP else chess.SQUARE_NAMES[record["ep"]]
+    return f"{'/'.join(ranks)} {turn} {castling} {ep} {record['halfmove']} {record['fullmove']}"
+
+
+def encode_move(uci):
+    move = chess.Move.from_uci(uci)
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(code):
+    code = int(code)
+    return chess.Move(code & 63, (code >> 6) & 63, (code >> 12) or None).uci()
+
+
+def pack_moves(moves, record):
+    moves = moves.split(" ")
+    record["n_moves"] = len(moves)
+    for i, uci in enumerate(moves):
+        record["moves"][i] = encode_move(uci)
+
+
+def unpack_moves(record):
+    return " ".join(decode_move(code) for code in record["moves"][:record["n_moves"]])
+
+
+def unpack_distractors(record):
+    """
+    Returns the precomputed wrong answers in UCI format, or None if the puzzle has not been analysed.
+    """
+    if not record["flags"] & ANALYSED:
+        return None
+    return [decode_move(code) for code in record["distractors"] if code]
+
+
+def pack_themes(themes, unknown=None):
+    """
+    Returns the theme mask of a space separated theme list. Names missing from THEMES are added to unknown.
+    """
+    mask = 0
+    for theme in themes.split():
+        if theme in THEME_BITS:
+            mask |= 1 << THEME_BITS[theme]
+        elif unknown is not None:
+            unknown.add(theme)
+    return mask
+
+
+def find_theme(name):
+    """
+    Returns the Lichess theme matching a user supplied name (e.g. "mates" -> "mate"), or None.
+    """
+    lookup = {theme.lower(): theme for theme in THEMES}
+    name = name.lower()
+    return lookup.get(name) or lookup.get(name.removesuffix("s"))
+
+
+def compile_store(csv_path, store_path, chunk_size=10000):
+    """
+    Compiles a puzzle csv with FEN, Moves, Rating and (optionally) Themes columns into a binary puzzle store.
+
+        Returns:
+            count (int): number of puzzles written.
+    """
+    with open(csv_path, newline="") as src:
+        return write_store(csv.DictReader(src), store_path, chunk_size)
+
+
+def write_store(rows, store_path, chunk_size=10000):
+    """
+    Writes puzzle rows (dicts with FEN, Moves, Rating and optionally Themes) into a binary puzzle store,
+    holding at most chunk_size records in memory. The store replaces store_path once complete.
+
+        Returns:
+            count (int): number of puzzles written.
+    """
+    count = skipped = 0
+    unknown_themes = set()
+    chunk = np.zeros(chunk_size, dtype=RECORD)
+    temp_path = store_path + ".tmp"
+    with open(temp_path, "wb") as dest:
+        dest.write(HEADER.pack(MAGIC, VERSION, 0))
+        filled = 0
+        for row in rows:
+            if len(row["Moves"].split(" ")) > MAX_MOVES:
+                skipped += 1
+                continue
+            record = chunk[filled]
+            pack_fen(row["FEN"], record)
+            pack_moves(row["Moves"], record)
+            record["rating"] = int(row["Rating"])
+            record["themes"] = pack_themes(row.get("Themes") or "", unknown_themes)
+            filled += 1
+            if filled == chunk_size:
+                dest.write(chunk.tobytes())
+                count += filled
+                chunk[:] = 0
+                filled = 0
+        dest.write(chunk[:filled].tobytes())
+        count += filled
+
+        dest.seek(0)
+        dest.write(HEADER.pack(MAGIC, VERSION, count))
+    os.replace(temp_path, store_path)
+    if skipped:
+        logging.info(f"Skipped {skipped} puzzles longer than {MAX_MOVES} moves.")
+    if unknown_themes:
+        logging.warning(f"Dropped unknown puzzle themes: {', '.join(sorted(unknown_themes))}.")
+    return count
+
+
+def store_version(store_path):
+    with open(store_path, "rb") as f:
+        magic, version, _ = HEADER.unpack(f.read(HEADER.size))
+    return version if magic == MAGIC else None
+
+
+INDEX_MAGIC = b"CHIX"
+INDEX_HEADER = struct.Struct("<4sIIII") # magic, band width, min rating, band count, total index length
+
+
+def build_index(store_path, index_path, band_width=100):
+    """
+    Buckets the puzzles of a store by rating band and theme.
+
+    The index holds one row per theme (row 0 is "any theme") of puzzle numbers sorted by
+    rating band, and an offsets table where bucket (theme, band) is
+    indices[offsets[theme, band]:offsets[theme, band + 1]]. Consecutive bands of a theme are
+    contiguous, so any rating range of a theme is a single slice.
+    """
+    records = PuzzleStore(store_path).records
+    bands = (records["rating"].astype(np.int64) // band_width)
+    min_band = int(bands.min())
+    bands -= min_band
+    n_bands = int(bands.max()) + 1
+    themes = records["themes"]
+
+    rows, offsets = [], np.zeros((len(THEMES) + 1, n_bands + 1), dtype=np.int64)
+    position = 0
+    for row in range(len(THEMES) + 1):
+        if row == 0:
+            members = np.arange(len(records), dtype=np.uint32)
+        else:
+            members = np.flatnonzero(themes & np.uint64(1 << (row - 1))).astype(np.uint32)
+        member_bands = bands[members]
+        order = np.argsort(member_bands, kind="stable")
+        rows.append(members[order])
+        offsets[row] = position + np.searchsorted(member_bands[order], np.arange(n_bands + 1))
+        position += len(members)
+
+    with open(index_path, "wb") as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, band_width, min_band * band_width, n_bands, position))
+        f.write(offsets.tobytes())
+        for row in rows:
+            f.write(row.tobytes())
+
+
+class PuzzleIndex:
+    """
+    Memory-mapped rating/theme index built by build_index.
+    """
+    def __init__(self, index_path):
+        with open(index_path, "rb") as f:
+            magic, self.band_width, self.min_rating, self.n_bands, length = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{index_path} is not a puzzle index.")
+        offsets_size = (len(THEMES) + 1) * (self.n_bands + 1)
+        self.offsets = np.fromfile(index_path, dtype=np.int64, count=offsets_size,
+                                   offset=INDEX_HEADER.size).reshape(len(THEMES) + 1, self.n_bands + 1)
+        self.indices = np.memmap(index_path, dtype=np.uint32, mode="r", shape=(length,),
+                                 offset=INDEX_HEADER.size + self.offsets.nbytes)
+
+
+    def band(self, rating):
+        return min(max((rating - self.min_rating) // self.band_width, 0), self.n_bands - 1)
+
+
+    def draw(self, rating=None, theme=None, tolerance=100):
+        """
+        Returns the number of a random puzzle within tolerance of rating having the theme.
+        The rating range is widened band by band until a puzzle is found.
+
+            Parameters:
+                rating (int): target rating, None for any rating.
+                theme (str): Lichess theme name, None for any theme.
+                tolerance (int): accepted rating difference before widening.
+
+            Returns:
+                index (int): puzzle number in the store, None if no puzzle has the theme.
+        """
+        row = self.offsets[0 if theme is None else THEME_BITS[theme] + 1]
+        if rating is None:
+            low, high = 0, self.n_bands - 1
+        else:
+            low, high = self.band(rating - tolerance), self.band(rating + tolerance)
+        while True:
+            start, end = row[low], row[high + 1]
+            if end > start:
+                return int(self.indices[random.randrange(start, end)])
+            if low == 0 and high == self.n_bands - 1:
+                return None
+            low, high = max(low - 1, 0), min(high + 1, self.n_bands - 1)
+
+
+class PuzzleStore:
+    """
+    Read-only, memory-mapped view of a compiled puzzle store.
+    Pages are shared between every process that maps the same file.
+    """
+    def __init__(self, store_path, index_path=None, writable=False):
+        with open(store_path, "rb") as f:
+            magic, version, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{store_path} is not a version {VERSION} puzzle store.")
+        self.store_path = store_path
+        self.records = np.memmap(store_path, dtype=RECORD, mode="r+" if writable else "r", offset=HEADER.size,
+                                 shape=(count,))
+        self.index = PuzzleIndex(index_path) if index_path else None
+
+
+    def __len__(self):
+        return len(self.records)
+
+
+    def get(self, index):
+        """
+        Returns the FEN, UCI move list, rating and precomputed distractors (None if not analysed)
+        of the puzzle at index.
+        """
+        record = self.records[index]
+        return unpack_fen(record), unpack_moves(record), int(record["rating"]), unpack_distractors(record)
+
+
+    def sample(self, rating=None, theme=None):
+        """
+        Returns a random puzzle, optionally close to a rating and/or having a theme.
+        Returns None when no puzzle has the theme. Without an index, any puzzle is returned.
+        """
+        if self.index and (rating is not None or theme is not None):
+            index = self.index.draw(rating, theme)
+            if index is None:
+                logging.info(f"No puzzles with the theme {theme}.")
+                return None
+        else:
+            if theme is not None:
+                logging.warning(f"No puzzle index loaded, ignoring the theme {theme}.")
+            index = random.randrange(len(self.records))
+        return self.get(index)
@@ -0,0 +1,124 @@
+from collections import OrderedDict
+import hashlib, logging, os, threading
+
+
+class RenderCache:
+    """
+    Two-tier cache of rendered images: an in-memory LRU in front of a
+    content-addressed directory on disk that survives restarts.
+    Both tiers evict least recently used entries once over their byte budget.
+    """
+    def __init__(self, cache_dir, memory_bytes=32*2**20, disk_bytes=256*2**20):
+        """
+            Parameters:
+                cache_dir (str): directory of the disk tier, None to disable it.
+                memory_bytes (int): byte budget of the in-memory tier.
+                disk_bytes (int): byte budget of the disk tier.
+        """
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.disk = OrderedDict() # file name -> size, least recently used first
+        self.disk_size = 0
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if cache_dir and os.path.isdir(cache_dir):
+            entries = []
+            for entry in os.scandir(cache_dir):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+            for _, name, size in sorted(entries):
+                self.disk[name] = size
+                self.disk_size += size
+
+
+    @staticmethod
+    def digest(key):
+        return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+
+    def get(self, key):
+        """
+        Returns the cached bytes for key, or None.
+        """
+        name = self.digest(key)
+        with self.lock:
+            if name in self.memory:
+                self.memory.move_to_end(name)
+                self.hits["memory"] += 1
+                return self.memory[name]
+            on_disk = name in self.disk
+        if on_disk:
+            try:
+                with open(os.path.join(self.cache_dir, name), "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is not None:
+                with self.lock:
+                    if name in self.disk:
+                        self.disk.move_to_end(name)
+                    self.hits["disk"] += 1
+                    self._put_memory(name, data)
+                return data
+        with self.lock:
+            self.misses += 1
+        return None
+
+
+    def put(self, key, data):
+        name = self.digest(key)
+        with self.lock:
+            self._put_memory(name, data)
+            if not self.cache_dir or name in self.disk:
+                return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write then rename so that readers never see a partial file
+            path = os.path.join(self.cache_dir, name)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            logging.exception("Failed to write render cache entry.")
+            return
+        with self.lock:
+            if name not in self.disk:
+                self.disk[name] = len(data)
+                self.disk_size += len(data)
+            evicted = []
+            while self.disk_size > self.disk_bytes and len(self.disk) > 1:
+                old_name, size = self.disk.popitem(last=False)
+                self.disk_size -= size
+                evicted.append(old_name)
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.cache_dir, old_name))
+            except OSError:
+                pass
+
+
+    def _put_memory(self, name, data):
+        if name in self.memory:
+            self.memory.move_to_end(name)
+            return
+        self.memory[name] = data
+        self.memory_size += len(data)
+        while self.memory_size > self.memory_bytes and len(self.memory) > 1:
+            _, old_data = self.memory.popitem(last=False)
+            self.memory_size -= len(old_data)
+
+
+    def stats(self):
+        with self.lock:
+            hits = self.hits["memory"] + self.hits["disk"]
+            total = hits + self.misses
+            return {"memory_hits": self.hits["memory"], "disk_hits": self.hits["disk"], "misses": self.misses,
+                    "hit_rate": hits / total if total else 0.0,
+                    "memory_bytes": self.memory_size, "disk_bytes": self.disk_size}
@@ -1,57 +1,114 @@
-import pandas as pd
-import os, requests, zstandard, logging
+from utils.puzzle_store import write_store, build_index, store_version, VERSION
+from utils.opening_book import build_book
+from tqdm import tqdm
+import csv, io, os, requests, zstandard, logging
 
 PUZZLEURL = "https://database.lichess.org/lichess_db_puzzle.csv.zst"
-PUZZLE_PATH = "./data/chess_puzzles.csv" # Hardcoded path
+PUZZLE_STORE_PATH = "./data/chess_puzzles.bin" # Hardcoded path
+PUZZLE_INDEX_PATH = "./data/chess_puzzles.idx" # Hardcoded path
+OPENING_PGN_PATH = "./data/openings.pgn" # Games the opening book is compiled from
+OPENING_BOOK_PATH = "./data/opening_book.bin" # Hardcoded path
 
 STOCKFISHURL = "https://github.com/official-stockfish/Stockfish/releases/download/sf_16/stockfish-ubuntu-x86-64-avx2.tar"
 STOCKFISH_PATH = "./stockfish/stockfish-ubuntu-x86-64-avx2" # Hardcoded path
 #STOCKFISH_PATH = "./stockfish/stockfish-windows-x86-64-avx2" # Hardcoded path
 
-def download_chess_puzzles(rating_lower=None, rating_upper=None, count=1000000, overwrite=False):
+def open_source(source, timeout=60):
     """
-    Downloads Lichess puzzle database and uncompresses it.
-    Performs simple cleaning to reduce file size.
+    Opens a puzzle database for streaming, from a URL or a local file.
+
+        Returns:
+            stream (file): binary stream of the (possibly compressed) database.
+            size (int): length of the stream in bytes, None if unknown.
     """
-    logging.info("Downloading Lichess puzzle database")
-    if os.path.isfile(PUZZLE_PATH) and not overwrite:
-        logging.info("Lichess CSV file already exists! Skipping...")
-        return
-    
-    # Download lichess puzzle database
-    
-    response = requests.get(PUZZLEURL, timeout=60)
+    if source.startswith(("http://", "https://")):
+        response = requests.get(source, stream=True, timeout=timeout)
+        response.raise_for_status()
+        response.raw.decode_content = True
+        size = response.headers.get("Content-Length")
+        return response.raw, int(size) if size else None
+    return open(source, "rb"), os.path.getsize(source)
 
-    # # Download zst file
-    with open("lichess_db_puzzle.csv.zst", "wb") as f:
-        f.write(response.content)
 
-    # Uncompress zst file
-    with open("lichess_db_puzzle.csv.zst", "rb") as f:
-        decomp = zstandard.ZstdDecompressor()
-        with open("lichess_db_puzzle.csv", 'wb') as destination:
-            decomp.copy_stream(f, destination)
+class ProgressReader(io.RawIOBase):
+    """
+    Wraps a binary stream and reports the bytes read from it.
+    """
+    def __init__(self, stream, progress):
+        self.stream = stream
+        self.progress = progress
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        self.progress.update(len(data))
+        return len(data)
 
-    # Read csv file as pandas dataframe
-    df = pd.read_csv("lichess_db_puzzle.csv")
 
-    # Filter puzzles by length and rating
-    df2 = df[df["Themes"].str.contains("short")]
-    if rating_lower:
-        df2 = df2[df2["Rating"] >= rating_lower]
-    if rating_upper:
-        df2 = df2[df2["Rating"] <= rating_upper]
+def filter_puzzles(rows, rating_lower=None, rating_upper=None, count=None):
+    """
+    Keeps short puzzles within the rating bounds, stopping after count puzzles.
+    """
+    kept = 0
+    for row in rows:
+        if count is not None and kept >= count:
+            return
+        if "short" not in row["Themes"]:
+            continue
+        rating = int(row["Rating"])
+        if (rating_lower and rating < rating_lower) or (rating_upper and rating > rating_upper):
+            continue
+        kept += 1
+        yield row
+
+
+def ingest_chess_puzzles(source=PUZZLEURL, rating_lower=None, rating_upper=None, count=1000000, overwrite=False):
+    """
+    Streams the Lichess puzzle database into the binary puzzle store and builds its index.
+    The download is decompressed, parsed, filtered and packed chunk by chunk, so memory
+    stays bounded and no intermediate file is written.
+
+        Parameters:
+            source (str): URL or path of the database, .zst files are decompressed on the fly.
+            rating_lower (int): lowest puzzle rating kept.
+            rating_upper (int): highest puzzle rating kept.
+            count (int): maximum number of puzzles kept.
+            overwrite (bool): rebuild the store even if an up-to-date one exists.
+    """
+    logging.info("Ingesting Lichess puzzle database")
+    if os.path.isfile(PUZZLE_STORE_PATH) and os.path.isfile(PUZZLE_INDEX_PATH) and not overwrite \
+            and store_version(PUZZLE_STORE_PATH) == VERSION:
+        logging.info("Chess puzzle store already exists! Skipping...")
+        return
 
-    # Grab the first 1 million rows
-    df2 = df2.iloc[:count]
+    stream, size = open_source(source)
+    with stream, tqdm(total=size, unit="B", unit_scale=True, desc="puzzles") as progress:
+        reader = io.BufferedReader(ProgressReader(stream, progress))
+        if source.endswith(".zst"):
+            reader = zstandard.ZstdDecompressor().stream_reader(reader)
+        text = io.TextIOWrapper(reader, encoding="utf-8", newline="")
+        rows = filter_puzzles(csv.DictReader(text), rating_lower, rating_upper, count)
+        written = write_store(rows, PUZZLE_STORE_PATH)
+    build_index(PUZZLE_STORE_PATH, PUZZLE_INDEX_PATH)
+    logging.info(f"Ingested {written} puzzles.")
 
-    # Keep only FEN, moves and rating rows
-    df2 = df2[["FEN","Moves","Rating"]]
 
-    # Write cleaned csv file
-    df2.to_csv(PUZZLE_PATH,index=False)
-    os.remove("lichess_db_puzzle.csv")
-    os.remove("lichess_db_puzzle.csv.zst")
+def compile_opening_book(overwrite=False):
+    """
+    Compiles the Polyglot opening book used for vote chess from a PGN file of games, if one is provided.
+    """
+    logging.info("Compiling opening book")
+    if os.path.isfile(OPENING_BOOK_PATH) and not overwrite:
+        logging.info("Opening book already exists! Skipping...")
+        return
+    if not os.path.isfile(OPENING_PGN_PATH):
+        logging.info(f"No games found at {OPENING_PGN_PATH}! Skipping...")
+        return
+    count = build_book(OPENING_PGN_PATH, OPENING_BOOK_PATH)
+    logging.info(f"Compiled {count} book entries.")
 
 
 def download_stockfish():
@@ -81,10 +138,11 @@ def setup():
     """
     logging.info("Downloading database and chess engines...")
     os.makedirs("./data", exist_ok=True)
-    download_chess_puzzles(rating_lower=1450)
+    ingest_chess_puzzles(rating_lower=1450)
+    compile_opening_book()
     download_stockfish()
     logging.info("Download complete!")
 
 
 if __name__ == "__main__":
-    download_chess_puzzles(rating_lower=1800)
\ No newline at end of file
+    ingest_chess_puzzles(rating_lower=1800, overwrite=True)
\ No newline at end of file
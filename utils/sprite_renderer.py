@@ -0,0 +1,120 @@
+from cairosvg import svg2png
+from PIL import Image
+import numpy as np
+import chess, chess.svg, io
+
+BASE_SIZE = 8 * chess.svg.SQUARE_SIZE + 2 * 15 # chess.svg board with coordinates
+SQUARE_COLORS = {
+    (True, False): chess.svg.DEFAULT_COLORS["square light"],
+    (False, False): chess.svg.DEFAULT_COLORS["square dark"],
+    (True, True): chess.svg.DEFAULT_COLORS["square light lastmove"],
+    (False, True): chess.svg.DEFAULT_COLORS["square dark lastmove"],
+}
+
+
+def rasterise(svg):
+    return Image.open(io.BytesIO(svg2png(bytestring=svg))).convert("RGBA")
+
+
+def hex_to_rgb(color):
+    color = color.lstrip("#")
+    return np.array([int(color[i:i+2], 16) for i in (0, 2, 4)], dtype=np.float32)
+
+
+class SpriteRenderer:
+    """
+    Draws chess boards by compositing pre-rasterised square and piece sprites with NumPy,
+    reproducing the chess.svg look without running cairosvg for every board.
+    """
+    def __init__(self, size=None):
+        """
+            Parameters:
+                size (int): board size in pixels, rounded to a multiple of 26 so that squares
+                            stay whole pixels. Defaults to the chess.svg size of 390.
+        """
+        scale = max(1, round((size or BASE_SIZE) / (BASE_SIZE / 15))) / 15
+        self.size = round(BASE_SIZE * scale)
+        self.margin = round(15 * scale)
+        self.square_size = round(chess.svg.SQUARE_SIZE * scale)
+
+        # The empty board provides the margin and coordinates for each orientation
+        empty = chess.BaseBoard.empty()
+        self.frames = {flipped: np.asarray(rasterise(chess.svg.board(empty, flipped=flipped, size=self.size)))[:, :, :3]
+                       for flipped in (False, True)}
+        self.square_colors = {key: hex_to_rgb(color) for key, color in SQUARE_COLORS.items()}
+        self.pieces = {}
+        for color in chess.COLORS:
+            for piece_type in chess.PIECE_TYPES:
+                piece = chess.Piece(piece_type, color)
+                sprite = np.asarray(rasterise(chess.svg.piece(piece, size=self.square_size)), dtype=np.float32)
+                self.pieces[piece.symbol()] = (sprite[:, :, :3], sprite[:, :, 3:] / 255)
+
+
+    def square_origin(self, square, flipped):
+        file_index, rank_index = chess.square_file(square), chess.square_rank(square)
+        if flipped:
+            file_index, rank_index = 7 - file_index, 7 - rank_index
+        return self.margin + file_index * self.square_size, self.margin + (7 - rank_index) * self.square_size
+
+
+    def draw_square(self, canvas, square, piece, highlighted, flipped):
+        """
+        Paints one square and the piece standing on it into canvas.
+        """
+        x, y = self.square_origin(square, flipped)
+        light = bool(chess.BB_LIGHT_SQUARES & chess.BB_SQUARES[square])
+        tile = np.empty((self.square_size, self.square_size, 3), dtype=np.float32)
+        tile[:] = self.square_colors[(light, highlighted)]
+        if piece:
+            rgb, alpha = self.pieces[piece.symbol()]
+            tile = tile * (1 - alpha) + rgb * alpha
+        canvas[y:y+self.square_size, x:x+self.square_size] = np.rint(tile).astype(np.uint8)
+
+
+    def render_array(self, board, flipped, lastmove=None):
+        canvas = self.frames[flipped].copy()
+        highlighted = (lastmove.from_square, lastmove.to_square) if lastmove else ()
+        for square in chess.SQUARES:
+            self.draw_square(canvas, square, board.piece_at(square), square in highlighted, flipped)
+        return canvas
+
+
+    def render(self, board, flipped, lastmove=None):
+        return Image.fromarray(self.render_array(board, flipped, lastmove))
+
+
+    def render_png(self, board, flipped, lastmove=None):
+        buffer = io.BytesIO()
+        self.render(board, flipped, lastmove).save(buffer, format="PNG")
+        return buffer.getvalue()
+
+
+    def render_line(self, board, moves, flipped):
+        """
+        Renders one frame per move played from board, redrawing only the squares
+        whose piece or highlighting changed since the previous frame.
+
+            Parameters:
+                board (chess.Board): starting position, moves are pushed onto it.
+                moves (list): chess.Move objects to play.
+                flipped (bool): board orientation.
+
+            Returns:
+                frames (list): PIL images, one per move.
+        """
+        lastmove = board.peek() if board.move_stack else None
+        canvas = self.render_array(board, flipped, lastmove)
+        frames = []
+        for move in moves:
+            before = board.piece_map()
+            old_highlight = {lastmove.from_square, lastmove.to_square} if lastmove else set()
+            board.push(move)
+            after = board.piece_map()
+            lastmove = move
+            new_highlight = {move.from_square, move.to_square}
+
+            changed = {square for square in before.keys() | after.keys() if before.get(square) != after.get(square)}
+            for square in changed | old_highlight | new_highlight:
+                self.draw_square(canvas, square, after.get(square), square in new_highlight, flipped)
+            frames.append(Image.fromarray(canvas.copy()))
+        return frames
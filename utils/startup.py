@@ -0,0 +1,103 @@
+import asyncio, logging, time
+
+
+class StartupTimer:
+    """
+    Records how long after process start each startup phase finished.
+    """
+    def __init__(self, start=None):
+        self.start = start or time.perf_counter()
+        self.phases = {} # phase -> seconds since start
+
+    def mark(self, phase):
+        self.phases[phase] = time.perf_counter() - self.start
+        logging.info(f"Startup: {phase} after {self.phases[phase]:.2f}s.")
+
+    def report(self):
+        return "\n".join([f"{phase}: {seconds:.2f}s" for phase, seconds in self.phases.items()]) or "Starting up."
+
+
+class LazyResource:
+    """
+    Builds a heavy object (e.g. a game handler) in a background thread after the bot is up
+    and forwards attribute access to it.
+    Awaitable *_async methods called before the object is ready wait for it, so requests
+    arriving during startup are queued instead of failing. Other attributes raise until then.
+    A failed build is retried by a later request, after a delay doubling with each failure.
+    """
+    def __init__(self, name, factory, timer=None, retry_delay=10.0, max_retry_delay=3600.0):
+        """
+            Parameters:
+                name (str): name used in logs and in the startup report.
+                factory (callable): builds the object, runs in a worker thread.
+                timer (StartupTimer): records when the object is ready.
+                retry_delay (float): seconds before the first retry of a failed build.
+                max_retry_delay (float): longest delay between retries.
+        """
+        self._name = name
+        self._factory = factory
+        self._timer = timer
+        self._retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        self._obj = None
+        self._task = None
+        self._failures = 0
+        self._retry_at = 0 # time.monotonic() before which a failed build is not retried
+        self._error = None
+
+
+    def start(self):
+        """
+        Starts building the object. Must be called from the running event loop.
+        After a failed build, calling it again retries once the retry delay is over
+        and raises RuntimeError before then.
+        """
+        if self._task is None:
+            wait = self._retry_at - time.monotonic()
+            if wait > 0:
+                raise RuntimeError(f"{self._name} failed to start, retrying in {wait:.0f}s.") from self._error
+            self._task = asyncio.create_task(self._load())
+        return self._task
+
+
+    async def _load(self):
+        try:
+            self._obj = await asyncio.to_thread(self._factory)
+        except Exception as e:
+            # A later request starts it again, so a transient failure at boot is not permanent.
+            # The delay keeps a lasting failure (e.g. a failing download) from being retried in a loop.
+            delay = min(self._retry_delay * 2**self._failures, self._max_retry_delay)
+            logging.exception(f"Failed to start {self._name}, retrying after {delay:.0f}s.")
+            self._failures += 1
+            self._retry_at = time.monotonic() + delay
+            self._error = e
+            self._task = None
+            raise
+        self._failures = 0
+        self._error = None
+        if self._timer:
+            self._timer.mark(self._name)
+
+
+    def is_ready(self):
+        return self._obj is not None
+
+
+    async def wait(self):
+        """
+        Returns the object once it is built.
+        """
+        if self._obj is None:
+            await self.start()
+        return self._obj
+
+
+    def __getattr__(self, attr):
+        if self._obj is not None:
+            return getattr(self._obj, attr)
+        if attr.endswith("_async"):
+            async def call_when_ready(*args, **kwargs):
+                obj = await self.wait()
+                return await getattr(obj, attr)(*args, **kwargs)
+            return call_when_ready
+        raise RuntimeError(f"{self._name} is still starting up.")
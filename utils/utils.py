@@ -5,6 +5,7 @@ Beep boop! Welcome to the Chessbot-3000. This bot lets you discover your inner c
 
 \U0001F9E9 Chess Puzzles \U0001F9E9
 /chess - Sends a puzzle from the lichess database.
+/chess <rating> <theme> - Sends a puzzle near a rating and/or with a theme, e.g. /chess 1800 mates
 /votechess - Vote on the best move to beat Stockfish!
 /votechess resign - For when you know all is lost.
 
@@ -18,8 +19,10 @@ Beep boop! Welcome to the Chessbot-3000. This bot lets you discover your inner c
 Utility
 /start - Displays the commands available
 /schedule <game> <time> - Schedules a game to be sent everyday
+/schedule chess <time> <rating> <theme> - Schedules a chess puzzle of a given difficulty or theme
 /schedule_view - Displays all scheduled tasks
 /schedule_clear - Clears all scheduled tasks
+/schedule_shared <on/off> - Receive the same scheduled puzzles as other chats, or puzzles of your own
     """
 
 